@@ -0,0 +1,77 @@
+"""Helpers shared by the benchmarks: running fake_replicate and the app."""
+import asyncio
+import logging
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+
+from werkzeug.serving import make_server
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import fake_replicate  # noqa: E402
+
+MODEL = 'fake/model:v1'
+
+
+def serve_fake(fake):
+  """Run the fake API on a background event loop, returning its URL."""
+  loop = asyncio.new_event_loop()
+  started = threading.Event()
+  result = {}
+
+  def target():
+    asyncio.set_event_loop(loop)
+    result['runner'], result['url'] = loop.run_until_complete(
+      fake_replicate.start(fake))
+    started.set()
+    loop.run_forever()
+
+  threading.Thread(target=target, daemon=True).start()
+  started.wait()
+  return result['url']
+
+
+def serve_app(app):
+  """Serve a WSGI app from a background thread, returning its URL."""
+  logging.getLogger('werkzeug').setLevel(logging.ERROR)
+  server = make_server('127.0.0.1', 0, app, threaded=True)
+  threading.Thread(target=server.serve_forever, daemon=True).start()
+  return f'http://127.0.0.1:{server.server_port}'
+
+
+def free_port():
+  with socket.socket() as s:
+    s.bind(('127.0.0.1', 0))
+    return s.getsockname()[1]
+
+
+def start_server(args=(), env=None):
+  """Launch llm_api.serve and wait until it answers; return (process, URL)."""
+  port = free_port()
+  proc = subprocess.Popen(
+    [sys.executable, '-m', 'llm_api.serve', '--bind', f'127.0.0.1:{port}',
+     *args],
+    cwd=ROOT, env=dict(os.environ, **(env or {})),
+    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+  url = f'http://127.0.0.1:{port}'
+  while True:
+    try:
+      urllib.request.urlopen(url + '/stats', timeout=1)
+      return proc, url
+    except OSError:
+      if proc.poll() is not None:
+        raise SystemExit('server exited during startup')
+      time.sleep(0.01)
+
+
+def percentile(values, p):
+  """Nearest-rank percentile of an already sorted list."""
+  if not values:
+    return None
+  return values[min(len(values) - 1, max(0, round(p / 100 * len(values)) - 1))]
@@ -0,0 +1,195 @@
+"""Load test /predict against a local fake Replicate backend.
+
+Starts fake_replicate and the app (llm_api.serve by default, or main.app on
+an in-process Werkzeug server), drives an endpoint at each concurrency level
+and reports latency percentiles, requests per second and upstream API calls
+per request. Results are written as JSON for comparison between runs.
+
+  python benchmarks/load.py --concurrency 1,8,32 --requests 200
+  python benchmarks/load.py --throttle-rate 0.05 --baseline old.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import subprocess
+import time
+
+import aiohttp
+
+from harness import (MODEL, ROOT, fake_replicate, percentile, serve_app,
+                     serve_fake, start_server)
+
+
+async def drive(url, endpoint, n, concurrency, unique):
+  """Send `n` requests, at most `concurrency` at a time."""
+  latencies = []
+  first_bytes = []
+  statuses = {}
+  pending = iter(range(n))
+
+  async def worker(session):
+    for i in pending:
+      params = {'model': MODEL, 'instruction': 'bench',
+                'input': f'{i}-{time.time()}' if unique else 'bench'}
+      start = time.perf_counter()
+      try:
+        async with session.get(url + endpoint, params=params) as resp:
+          await resp.content.readany()
+          first_bytes.append(time.perf_counter() - start)
+          await resp.read()
+          status = str(resp.status)
+      except aiohttp.ClientError as e:
+        status = type(e).__name__
+      latencies.append(time.perf_counter() - start)
+      statuses[status] = statuses.get(status, 0) + 1
+
+  connector = aiohttp.TCPConnector(limit=concurrency)
+  timeout = aiohttp.ClientTimeout(total=300)
+  async with aiohttp.ClientSession(connector=connector,
+                                   timeout=timeout) as session:
+    start = time.perf_counter()
+    await asyncio.gather(*[worker(session) for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+  return sorted(latencies), sorted(first_bytes), statuses, elapsed
+
+
+def summarize(concurrency, n, latencies, first_bytes, statuses, elapsed,
+              calls):
+  ms = lambda value: None if value is None else round(value * 1000, 1)
+  # Throttled requests never reach the handlers but still cost a round trip
+  upstream = (calls['version'] + calls['create'] + calls['get'] +
+              calls['cancel'] + calls['throttled'])
+  return {
+    'concurrency': concurrency,
+    'requests': n,
+    'statuses': statuses,
+    'rps': round(n / elapsed, 2),
+    'latency_ms': {
+      'p50': ms(percentile(latencies, 50)),
+      'p95': ms(percentile(latencies, 95)),
+      'p99': ms(percentile(latencies, 99)),
+      'max': ms(latencies[-1] if latencies else None),
+    },
+    'first_byte_ms': {
+      'p50': ms(percentile(first_bytes, 50)),
+      'p95': ms(percentile(first_bytes, 95)),
+    },
+    'upstream_calls_per_request': round(upstream / n, 2),
+    'upstream_calls': calls,
+  }
+
+
+def compare(results, baseline_path):
+  with open(baseline_path) as f:
+    baseline = {level['concurrency']: level for level in json.load(f)['levels']}
+  for level in results['levels']:
+    old = baseline.get(level['concurrency'])
+    if old is None:
+      continue
+    changes = []
+    for label, new_value, old_value in [
+      ('p50', level['latency_ms']['p50'], old['latency_ms']['p50']),
+      ('p95', level['latency_ms']['p95'], old['latency_ms']['p95']),
+      ('p99', level['latency_ms']['p99'], old['latency_ms']['p99']),
+      ('rps', level['rps'], old['rps']),
+    ]:
+      if new_value is not None and old_value:
+        changes.append(f'{label} {100 * (new_value / old_value - 1):+.1f}%')
+    print(f"c={level['concurrency']} vs baseline: " + ', '.join(changes))
+
+
+def git_revision():
+  try:
+    return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                          capture_output=True, text=True,
+                          check=True).stdout.strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--concurrency', default='1,8,32',
+                      help='comma separated concurrency levels')
+  parser.add_argument('--requests', type=int, default=100,
+                      help='requests per concurrency level')
+  parser.add_argument('--endpoint', default='/predict',
+                      choices=['/predict', '/predict/stream'])
+  parser.add_argument('--server', default='gunicorn',
+                      choices=['gunicorn', 'werkzeug'])
+  parser.add_argument('--workers', type=int, default=2)
+  parser.add_argument('--cache', action='store_true',
+                      help='repeat one prompt and keep the result cache on')
+  parser.add_argument('--queue-delay', type=float, default=0.1)
+  parser.add_argument('--token-delay', type=float, default=0.02)
+  parser.add_argument('--tokens', type=int, default=20,
+                      help='tokens each fake prediction streams')
+  parser.add_argument('--error-rate', type=float, default=0.0)
+  parser.add_argument('--throttle-rate', type=float, default=0.0)
+  parser.add_argument('--retry-after', type=int)
+  parser.add_argument('--output', help='JSON results path (default: '
+                      'benchmarks/results/load-<timestamp>.json)')
+  parser.add_argument('--baseline', help='earlier results to compare with')
+  args = parser.parse_args()
+
+  tokens = [' Token.' if i % 5 == 4 else ' token' for i in range(args.tokens)]
+  fake = fake_replicate.FakeReplicate(queue_delay=args.queue_delay,
+                                      token_delay=args.token_delay,
+                                      tokens=tokens,
+                                      error_rate=args.error_rate,
+                                      throttle_rate=args.throttle_rate,
+                                      retry_after=args.retry_after, seed=0)
+  env = {
+    'REPLICATE_API_BASE_URL': serve_fake(fake),
+    'replicate_api': os.environ.get('replicate_api', 'benchmark'),
+    'RESULT_CACHE': 'memory' if args.cache else 'off',
+  }
+  proc = None
+  if args.server == 'gunicorn':
+    proc, url = start_server(['--workers', str(args.workers)], env=env)
+  else:
+    os.environ.update(env)
+    from llm_api import main as service
+    url = serve_app(service.app)
+
+  levels = [int(c) for c in args.concurrency.split(',')]
+  results = {
+    'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+    'git_revision': git_revision(),
+    'config': vars(args),
+    'levels': [],
+  }
+  try:
+    for concurrency in levels:
+      before = dict(fake.calls)
+      measured = asyncio.run(drive(url, args.endpoint, args.requests,
+                                   concurrency, unique=not args.cache))
+      calls = {k: fake.calls[k] - before[k] for k in before}
+      level = summarize(concurrency, args.requests, *measured, calls)
+      results['levels'].append(level)
+      print(f"c={concurrency:<4} rps={level['rps']:<8} "
+            f"p50={level['latency_ms']['p50']}ms "
+            f"p95={level['latency_ms']['p95']}ms "
+            f"p99={level['latency_ms']['p99']}ms "
+            f"upstream/req={level['upstream_calls_per_request']} "
+            f"statuses={level['statuses']}")
+  finally:
+    if proc is not None:
+      proc.send_signal(signal.SIGTERM)
+      proc.wait(timeout=60)
+
+  output = args.output or os.path.join(
+    ROOT, 'benchmarks', 'results',
+    time.strftime('load-%Y%m%d-%H%M%S.json'))
+  os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+  with open(output, 'w') as f:
+    json.dump(results, f, indent=2)
+  print('wrote', output)
+  if args.baseline:
+    compare(results, args.baseline)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,93 @@
+"""Compare completion detection strategies for /predict.
+
+Runs main.app against fake_replicate and reports, per strategy, the latency
+added on top of the fake model's generation time and the number of
+Replicate API calls made per prediction.
+
+  python benchmarks/polling.py --requests 20 --concurrency 4
+"""
+import argparse
+import json
+import os
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from harness import MODEL, fake_replicate, serve_app, serve_fake
+
+
+def measure(url, fake, n, concurrency):
+  session = requests.Session()
+
+  def one(i):
+    start = time.perf_counter()
+    resp = session.get(url + '/predict',
+                       params={'model': MODEL, 'input': str(i)})
+    resp.raise_for_status()
+    return time.perf_counter() - start
+
+  # Warm the version cache and the poller's duration history
+  one(-1)
+  before = dict(fake.calls)
+  with ThreadPoolExecutor(concurrency) as pool:
+    latencies = list(pool.map(one, range(n)))
+  calls = {k: fake.calls[k] - before[k] for k in before}
+  generation = fake.queue_delay + fake.token_delay * len(fake.tokens)
+  added = sorted(max(0.0, t - generation) * 1000 for t in latencies)
+  return {
+    'added_ms_mean': round(statistics.mean(added), 1),
+    'added_ms_p95': round(added[int(0.95 * (len(added) - 1))], 1),
+    'api_calls_per_prediction': round(
+      (calls['version'] + calls['create'] + calls['get'] +
+       calls['throttled']) / n, 2),
+    'gets_per_prediction': round(calls['get'] / n, 2),
+    'webhooks_per_prediction': round(calls['webhook'] / n, 2),
+  }
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--requests', type=int, default=20)
+  parser.add_argument('--concurrency', type=int, default=4)
+  parser.add_argument('--queue-delay', type=float, default=0.3)
+  parser.add_argument('--token-delay', type=float, default=0.1)
+  parser.add_argument('--json', help='also write the results to this file')
+  args = parser.parse_args()
+
+  fake = fake_replicate.FakeReplicate(queue_delay=args.queue_delay,
+                                      token_delay=args.token_delay)
+  os.environ['REPLICATE_API_BASE_URL'] = serve_fake(fake)
+  os.environ.setdefault('replicate_api', 'benchmark')
+  # Every strategy reuses the same prompts
+  os.environ['RESULT_CACHE'] = 'off'
+  # Registers the webhook route; the URL is set per strategy below
+  os.environ['WEBHOOK_URL'] = 'http://127.0.0.1/webhooks/replicate'
+  os.environ.setdefault('WEBHOOK_SECRET', 'benchmark')
+
+  from llm_api import main as service
+  from llm_api.completion import AdaptivePoller
+  url = serve_app(service.app)
+
+  strategies = {
+    # What Prediction.wait() does
+    'fixed-0.5s': (AdaptivePoller(initial=0.5, maximum=0.5, factor=1,
+                                  history=False), None),
+    'adaptive': (AdaptivePoller(), None),
+    'adaptive+webhook': (AdaptivePoller(), url + '/webhooks/replicate'),
+  }
+  results = {}
+  for name, (poller, webhook) in strategies.items():
+    service.poller = poller
+    service.WEBHOOK_URL = webhook
+    results[name] = measure(url, fake, args.requests, args.concurrency)
+    print(name, json.dumps(results[name]))
+
+  if args.json:
+    with open(args.json, 'w') as f:
+      json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+  main()
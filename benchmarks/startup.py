@@ -0,0 +1,86 @@
+"""Measure import time of main and cold start of the production server.
+
+Fails (exit status 1) when either exceeds its budget.
+
+  python benchmarks/startup.py --runs 5 --json startup.json
+"""
+import argparse
+import json
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import time
+
+from harness import ROOT, start_server
+
+IMPORT_SNIPPET = '''
+import time
+start = time.perf_counter()
+from llm_api import main
+print(time.perf_counter() - start, main._client is not None)
+'''
+
+
+def env():
+  return dict(os.environ, replicate_api=os.environ.get('replicate_api', 'x'))
+
+
+def measure_import(runs):
+  times = []
+  for _ in range(runs):
+    out = subprocess.run([sys.executable, '-c', IMPORT_SNIPPET], cwd=ROOT,
+                         env=env(), check=True, capture_output=True,
+                         text=True).stdout.split()
+    if out[1] == 'True':
+      raise SystemExit('main created the Replicate client at import time')
+    times.append(float(out[0]) * 1000)
+  return times
+
+
+def measure_server(workers):
+  """Return (ms to first response, ms to exit after SIGTERM)."""
+  start = time.perf_counter()
+  proc, _ = start_server(['--workers', str(workers)], env=env())
+  try:
+    ready = time.perf_counter()
+    proc.send_signal(signal.SIGTERM)
+    proc.wait(timeout=30)
+    return (ready - start) * 1000, (time.perf_counter() - ready) * 1000
+  finally:
+    if proc.poll() is None:
+      proc.kill()
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--runs', type=int, default=5)
+  parser.add_argument('--workers', type=int, default=2)
+  parser.add_argument('--max-import-ms', type=float, default=1000)
+  parser.add_argument('--max-startup-ms', type=float, default=3000)
+  parser.add_argument('--json', help='also write the results to this file')
+  args = parser.parse_args()
+
+  imports = measure_import(args.runs)
+  servers = [measure_server(args.workers) for _ in range(args.runs)]
+  results = {
+    'import_ms_median': round(statistics.median(imports), 1),
+    'import_ms_max': round(max(imports), 1),
+    'startup_ms_median': round(statistics.median(s[0] for s in servers), 1),
+    'startup_ms_max': round(max(s[0] for s in servers), 1),
+    'shutdown_ms_median': round(statistics.median(s[1] for s in servers), 1),
+    'workers': args.workers,
+  }
+  print(json.dumps(results, indent=2))
+  if args.json:
+    with open(args.json, 'w') as f:
+      json.dump(results, f, indent=2)
+
+  ok = (results['import_ms_max'] <= args.max_import_ms
+        and results['startup_ms_max'] <= args.max_startup_ms)
+  sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,213 @@
+"""Local stand-in for the parts of the Replicate API this service uses.
+
+Run it with `python fake_replicate.py --port 5001` and point the app at it
+with REPLICATE_API_BASE_URL=http://localhost:5001.
+"""
+import argparse
+import asyncio
+import itertools
+import random
+import time
+from datetime import datetime, timezone
+
+import aiohttp
+from aiohttp import web
+
+STREAMING_SCHEMA = {
+  'components': {
+    'schemas': {
+      'Output': {
+        'type': 'array',
+        'items': {'type': 'string'},
+        'x-cog-array-type': 'iterator',
+      },
+    },
+  },
+}
+
+DEFAULT_TOKENS = ['Hello', ' there.', ' This', ' is', ' a', ' fake', ' model.',
+                  ' It', ' never', ' finishes']
+
+
+def timestamp(t):
+  return datetime.fromtimestamp(t, timezone.utc).isoformat()
+
+
+class FakeReplicate:
+  """Predictions start after `queue_delay` seconds and then produce one of
+  `tokens` every `token_delay` seconds.
+
+  Predictions created with a webhook get their `start`, `output` and
+  `completed` events POSTed to it, honouring webhook_events_filter.
+
+  A fraction `error_rate` of predictions ends up failed, and a fraction
+  `throttle_rate` of API requests is answered with 429, with a Retry-After
+  header when `retry_after` is set.
+  """
+
+  def __init__(self, queue_delay=0.0, token_delay=0.05, tokens=None,
+               error_rate=0.0, throttle_rate=0.0, retry_after=None, seed=None):
+    self.queue_delay = queue_delay
+    self.token_delay = token_delay
+    self.tokens = tokens or DEFAULT_TOKENS
+    self.error_rate = error_rate
+    self.throttle_rate = throttle_rate
+    self.retry_after = retry_after
+    self.random = random.Random(seed)
+    self.predictions = {}
+    self.calls = {'version': 0, 'create': 0, 'get': 0, 'cancel': 0,
+                  'webhook': 0, 'throttled': 0}
+    self._ids = itertools.count(1)
+    self._session = None
+
+  async def _webhook_session(self, app):
+    self._session = aiohttp.ClientSession()
+    yield
+    await self._session.close()
+
+  @web.middleware
+  async def throttle(self, request, handler):
+    if self.random.random() < self.throttle_rate:
+      self.calls['throttled'] += 1
+      headers = {}
+      if self.retry_after is not None:
+        headers['Retry-After'] = str(self.retry_after)
+      return web.json_response({'detail': 'Request was throttled.'},
+                               status=429, headers=headers)
+    return await handler(request)
+
+  def make_app(self):
+    app = web.Application(middlewares=[self.throttle])
+    app.cleanup_ctx.append(self._webhook_session)
+    app.router.add_get('/v1/models/{owner}/{name}/versions/{version}',
+                       self.get_version)
+    app.router.add_post('/v1/predictions', self.create_prediction)
+    app.router.add_get('/v1/predictions/{id}', self.get_prediction)
+    app.router.add_post('/v1/predictions/{id}/cancel', self.cancel_prediction)
+    return app
+
+  async def get_version(self, request):
+    self.calls['version'] += 1
+    return web.json_response({
+      'id': request.match_info['version'],
+      'created_at': '2023-01-01T00:00:00Z',
+      'cog_version': '0.6.1',
+      'openapi_schema': STREAMING_SCHEMA,
+    })
+
+  async def create_prediction(self, request):
+    self.calls['create'] += 1
+    body = await request.json()
+    id = f'fake{next(self._ids)}'
+    self.predictions[id] = {
+      'created': time.time(),
+      'version': body['version'],
+      'input': body.get('input'),
+      'fails': self.random.random() < self.error_rate,
+    }
+    if body.get('webhook'):
+      events = body.get('webhook_events_filter') or ['start', 'output', 'logs',
+                                                     'completed']
+      asyncio.ensure_future(self.send_webhooks(id, body['webhook'], events))
+    return web.json_response(self.render(id), status=201)
+
+  async def send_webhooks(self, id, url, events):
+    p = self.predictions[id]
+    started = p['created'] + self.queue_delay
+    moments = []
+    if 'start' in events:
+      moments.append(started)
+    if 'output' in events:
+      moments += [started + self.token_delay * (i + 1)
+                  for i in range(len(self.tokens) - 1)]
+    # The final output is only ever sent as the completed event
+    moments.append(started + self.token_delay * len(self.tokens))
+    for i, moment in enumerate(moments):
+      await asyncio.sleep(max(0, moment - time.time()))
+      prediction = self.render(id)
+      if i < len(moments) - 1 or 'completed' in events:
+        self.calls['webhook'] += 1
+        try:
+          async with self._session.post(url, json=prediction):
+            pass
+        except aiohttp.ClientError:
+          pass
+
+  async def get_prediction(self, request):
+    self.calls['get'] += 1
+    id = request.match_info['id']
+    if id not in self.predictions:
+      return web.json_response({'detail': 'Not found.'}, status=404)
+    return web.json_response(self.render(id))
+
+  async def cancel_prediction(self, request):
+    self.calls['cancel'] += 1
+    id = request.match_info['id']
+    if id not in self.predictions:
+      return web.json_response({'detail': 'Not found.'}, status=404)
+    prediction = self.render(id)
+    if prediction['status'] not in ('succeeded', 'failed', 'canceled'):
+      self.predictions[id]['canceled'] = time.time()
+    return web.json_response(self.render(id))
+
+  def render(self, id):
+    p = self.predictions[id]
+    started = p['created'] + self.queue_delay
+    completed = started + self.token_delay * len(self.tokens)
+    # A canceled prediction stops where it was
+    now = min(time.time(), p.get('canceled') or float('inf'))
+    prediction = {
+      'id': id,
+      'version': p['version'],
+      'input': p['input'],
+      'logs': '',
+      'error': None,
+      'output': None,
+      'status': 'starting',
+      'created_at': timestamp(p['created']),
+      'started_at': None,
+      'completed_at': None,
+      'urls': {'get': f'/v1/predictions/{id}'},
+    }
+    if now >= started:
+      produced = int((now - started) / self.token_delay)
+      prediction.update(status='processing', started_at=timestamp(started),
+                        output=self.tokens[:produced])
+    if p.get('canceled'):
+      prediction.update(status='canceled',
+                        completed_at=timestamp(p['canceled']))
+    elif now >= completed and p['fails']:
+      prediction.update(status='failed', completed_at=timestamp(completed),
+                        error='fake failure')
+    elif now >= completed:
+      prediction.update(status='succeeded', completed_at=timestamp(completed),
+                        output=list(self.tokens))
+    return prediction
+
+
+async def start(fake, host='127.0.0.1', port=0):
+  """Serve `fake` in the running loop, returning (runner, base_url)."""
+  runner = web.AppRunner(fake.make_app())
+  await runner.setup()
+  site = web.TCPSite(runner, host, port)
+  await site.start()
+  port = runner.addresses[0][1]
+  return runner, f'http://{host}:{port}'
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--host', default='127.0.0.1')
+  parser.add_argument('--port', type=int, default=5001)
+  parser.add_argument('--queue-delay', type=float, default=0.0)
+  parser.add_argument('--token-delay', type=float, default=0.05)
+  parser.add_argument('--error-rate', type=float, default=0.0)
+  parser.add_argument('--throttle-rate', type=float, default=0.0)
+  parser.add_argument('--retry-after', type=int)
+  args = parser.parse_args()
+  fake = FakeReplicate(queue_delay=args.queue_delay,
+                       token_delay=args.token_delay,
+                       error_rate=args.error_rate,
+                       throttle_rate=args.throttle_rate,
+                       retry_after=args.retry_after)
+  web.run_app(fake.make_app(), host=args.host, port=args.port)
@@ -0,0 +1 @@
+"""The LLM API service: see main for the Flask app and serve for production."""
@@ -0,0 +1,163 @@
+import asyncio
+import itertools
+import os
+import re
+import time
+
+import aiohttp
+from replicate.exceptions import ModelError, ReplicateError
+from replicate.schema import make_schema_backwards_compatible
+
+from .completion import TERMINAL_STATUSES, AdaptivePoller
+
+# The statuses replicate.Client retries reads on
+RETRY_STATUSES = frozenset([429, 500, 502, 503, 504, 520, 521, 522, 523, 524,
+                            526, 527])
+MAX_RETRY_DELAY = 60.0
+
+
+class AsyncReplicate:
+  """Minimal asyncio client for the Replicate predictions API.
+
+  All requests share one aiohttp session whose connector keeps a bounded
+  pool of keep-alive connections, so a single process can hold many
+  predictions in flight. Must be created and closed inside a running loop.
+  Predictions are polled on the schedule of `poller`, an AdaptivePoller.
+
+  Like replicate.Client, GETs are retried on rate limits, server errors and
+  dropped connections, and POSTs only on rate limits, up to `retries`
+  times. Retries wait as long as Retry-After asks, or else `backoff`
+  seconds, doubling each time.
+  """
+
+  def __init__(self, api_token, base_url=None, poller=None,
+               max_connections=100, timeout=30.0, version_ttl=3600.0,
+               retries=5, backoff=0.5):
+    self.api_token = api_token
+    self.base_url = base_url or os.environ.get('REPLICATE_API_BASE_URL',
+                                               'https://api.replicate.com')
+    if poller is None:
+      poller = AdaptivePoller(
+        initial=float(os.environ.get('POLL_INITIAL', '0.05')),
+        maximum=float(os.environ.get('POLL_MAX', '2')))
+    self.poller = poller
+    self.version_ttl = version_ttl
+    self.retries = retries
+    self.backoff = backoff
+    # model_version -> (expires_at, task resolving to (version, streams))
+    self._versions = {}
+    self.session = aiohttp.ClientSession(
+      connector=aiohttp.TCPConnector(limit=max_connections,
+                                     keepalive_timeout=60),
+      timeout=aiohttp.ClientTimeout(total=timeout),
+      headers={
+        'Authorization': f'Token {api_token}',
+        'User-Agent': 'opensource-llm-api',
+      })
+
+  async def close(self):
+    await self.session.close()
+
+  def _retry_delay(self, retry_after, attempt):
+    try:
+      delay = float(retry_after)
+    except (TypeError, ValueError):
+      delay = self.backoff * 2 ** attempt
+    return min(max(delay, 0.0), MAX_RETRY_DELAY)
+
+  async def _request(self, method, path, **kwargs):
+    # Retrying a POST that may have reached the server could create a
+    # second prediction, so only rate limited ones are sent again
+    statuses = RETRY_STATUSES if method == 'GET' else {429}
+    for attempt in itertools.count():
+      retry = attempt < self.retries
+      try:
+        async with self.session.request(method, self.base_url + path,
+                                        **kwargs) as resp:
+          if retry and resp.status in statuses:
+            delay = self._retry_delay(resp.headers.get('Retry-After'),
+                                      attempt)
+          elif 400 <= resp.status < 600:
+            try:
+              detail = (await resp.json())['detail']
+            except (aiohttp.ContentTypeError, ValueError, KeyError,
+                    TypeError):
+              detail = f'HTTP error: {resp.status, resp.reason}'
+            raise ReplicateError(detail)
+          else:
+            return await resp.json()
+      except aiohttp.ClientConnectionError:
+        if not retry or method != 'GET':
+          raise
+        delay = self._retry_delay(None, attempt)
+      await asyncio.sleep(delay)
+
+  async def get_version(self, model_version):
+    """Return (version, streams), sharing one lookup between callers."""
+    entry = self._versions.get(model_version)
+    if entry is None or entry[0] <= time.monotonic():
+      task = asyncio.ensure_future(self._lookup_version(model_version))
+      entry = self._versions[model_version] = (time.monotonic() +
+                                               self.version_ttl, task)
+    try:
+      return await asyncio.shield(entry[1])
+    except Exception:
+      # Don't cache failures
+      if self._versions.get(model_version) is entry:
+        del self._versions[model_version]
+      raise
+
+  async def _lookup_version(self, model_version):
+    m = re.match(r'^(?P<model>[^/]+/[^:]+):(?P<version>.+)$', model_version)
+    if not m:
+      raise ReplicateError(
+        f'Invalid model_version: {model_version}. Expected format: owner/name:version'
+      )
+    version = await self._request(
+      'GET', f"/v1/models/{m.group('model')}/versions/{m.group('version')}")
+    # Decide streaming the way VersionCache does through
+    # Version.get_transformed_schema, which fixes up old cog schemas
+    schema = make_schema_backwards_compatible(version['openapi_schema'],
+                                              version['cog_version'])
+    output = schema['components']['schemas']['Output']
+    streams = (output.get('type') == 'array'
+               and output.get('x-cog-array-type') == 'iterator')
+    return version, streams
+
+  async def create_prediction(self, version_id, input, **kwargs):
+    body = {'version': version_id, 'input': input}
+    body.update((k, v) for k, v in kwargs.items() if v is not None)
+    return await self._request('POST', '/v1/predictions', json=body)
+
+  async def get_prediction(self, id):
+    return await self._request('GET', f'/v1/predictions/{id}')
+
+  async def run(self, model_version, input, **kwargs):
+    """Async counterpart of replicate.Client.run, yielding output chunks."""
+    version, streams = await self.get_version(model_version)
+    prediction = await self.create_prediction(version['id'], input, **kwargs)
+    backoff = self.poller.backoff(model_version, streaming=streams)
+    seen = 0
+    while True:
+      output = prediction.get('output')
+      if streams and isinstance(output, list):
+        for chunk in output[seen:]:
+          yield chunk
+        seen = len(output)
+      if prediction['status'] in TERMINAL_STATUSES:
+        break
+      await asyncio.sleep(backoff.next(prediction['status']))
+      prediction = await self.get_prediction(prediction['id'])
+    self.poller.record_times(model_version, prediction.get('created_at'),
+                             prediction.get('started_at'),
+                             prediction.get('completed_at'))
+
+    if prediction['status'] == 'failed':
+      raise ModelError(prediction.get('error'))
+    if not streams:
+      output = prediction.get('output')
+      if isinstance(output, list):
+        for chunk in output:
+          yield chunk
+      elif output is not None:
+        yield output
@@ -0,0 +1,87 @@
+"""asyncio serving path for the same API as main.py.
+
+Each in-flight prediction is a coroutine rather than a blocked worker
+thread, and all upstream traffic goes through one pooled AsyncReplicate
+client. Run with `python -m llm_api.async_main`.
+"""
+import os
+
+from aiohttp import web
+
+from . import sentences
+from .async_client import AsyncReplicate
+from .protocol import make_input, sse
+
+
+def prediction_args(request):
+  user_text = request.query.get('input', '')
+  instruction = request.query.get('instruction', '')
+  model = request.query.get('model', '')
+
+  return model, make_input(instruction, user_text)
+
+
+async def predict(request):
+  client = request.app['client']
+  model, input = prediction_args(request)
+
+  output = [chunk async for chunk in client.run(model, input)]
+
+  # keep only the complete sentences
+  final_response = sentences.trim(''.join(output))
+
+  return web.json_response({'response': final_response})
+
+
+async def predict_stream(request):
+  client = request.app['client']
+  model, input = prediction_args(request)
+
+  response = web.StreamResponse(headers={
+    'Content-Type': 'text/event-stream',
+    'Cache-Control': 'no-cache',
+    'X-Accel-Buffering': 'no',
+  })
+  await response.prepare(request)
+
+  async def send(data, event=None):
+    await response.write(sse(data, event).encode())
+
+  buffer = sentences.SentenceBuffer()
+  try:
+    async for chunk in client.run(model, input):
+      for text in buffer.feed(chunk):
+        await send({'text': text})
+    for text in buffer.finish():
+      await send({'text': text})
+  except Exception as e:
+    await send({'error': str(e)}, event='error')
+  else:
+    await send({}, event='done')
+  await response.write_eof()
+  return response
+
+
+async def replicate_client(app):
+  app['client'] = AsyncReplicate(
+    app['api_token'],
+    max_connections=int(os.environ.get('REPLICATE_MAX_CONNECTIONS', '100')),
+    timeout=float(os.environ.get('REPLICATE_TIMEOUT', '30')))
+  yield
+  await app['client'].close()
+
+
+def make_app(api_token):
+  app = web.Application()
+  app['api_token'] = api_token
+  app.cleanup_ctx.append(replicate_client)
+  app.router.add_get('/predict', predict)
+  app.router.add_get('/predict/stream', predict_stream)
+  return app
+
+
+# Run the app
+if __name__ == '__main__':
+  web.run_app(make_app(os.environ['replicate_api']),
+              host='0.0.0.0',
+              port=int(os.environ.get('PORT', '8080')))
@@ -0,0 +1,239 @@
+"""Run many predictions concurrently and collect them in completion order.
+
+Used by POST /predict/batch and, for offline jobs, from the command line:
+
+  python -m llm_api.batch prompts.jsonl --concurrency 16 > results.jsonl
+
+Each input line is a JSON object with `instruction`, `input` and `model`.
+"""
+import argparse
+import itertools
+import json
+import logging
+import sys
+import time
+from concurrent import futures
+
+from . import sentences
+from .completion import TERMINAL_STATUSES, WEBHOOK_FIELDS, AdaptivePoller
+
+FIELDS = ('instruction', 'input', 'model')
+
+log = logging.getLogger(__name__)
+
+
+def parse_items(body):
+  """Parse a JSON array or JSONL document of prediction items."""
+  body = body.strip()
+  if body.startswith('['):
+    items = json.loads(body)
+  else:
+    items = [json.loads(line) for line in body.splitlines() if line.strip()]
+  for index, item in enumerate(items):
+    if not isinstance(item, dict):
+      raise ValueError('each batch item must be a JSON object')
+    for field in FIELDS:
+      if field in item and not isinstance(item[field], str):
+        raise ValueError(f'item {index}: {field} must be a string')
+  return items
+
+
+class _Item:
+  """One job of a batch and the prediction made for it."""
+
+  def __init__(self, index, model, input):
+    self.index = index
+    self.model = model
+    self.input = input
+    self.ticket = None
+    self.prediction = None
+    self.backoff = None
+    self.due = 0.0
+    self.failures = 0
+
+
+def _create(client, version_cache, item, webhook):
+  version, _ = version_cache.get(item.model)
+  kwargs = {}
+  if webhook:
+    kwargs = {'webhook': webhook, 'webhook_events_filter': ['completed']}
+  return client.predictions.create(version=version, input=item.input,
+                                   **kwargs)
+
+
+def _reload(prediction):
+  prediction.reload()
+  return prediction
+
+
+def _cancel(prediction):
+  try:
+    prediction.cancel()
+  except Exception as e:
+    log.warning('could not cancel prediction %s: %s', prediction.id, e)
+
+
+def run_batch(client, version_cache, jobs, concurrency=8, poller=None,
+              hub=None, webhook=None, interval=0.25, scheduler=None,
+              priority=1, reload_attempts=5):
+  """Yield (index, prediction, error) for each (model, input) in `jobs`.
+
+  At most `concurrency` predictions are in flight. Each one is polled on
+  its own schedule from `poller`, an AdaptivePoller, and the polls that
+  are due run together on a shared thread pool. With a WebhookHub `hub`,
+  predictions are created with the `webhook` URL and delivered updates,
+  picked up every `interval` seconds, take the place of polls. With a
+  `scheduler`, each prediction also holds one of its slots until it
+  finishes. Items only take slots that are free: rather than queue or be
+  shed as Overloaded, they wait their turn, trying again every `interval`
+  seconds and whenever one of the batch's own predictions finishes.
+
+  A failed poll is retried on the same schedule; after `reload_attempts`
+  failures in a row the prediction is canceled and reported as failed.
+  Predictions still running when the consumer stops are canceled too, so
+  no upstream work outlives its scheduler slot.
+  """
+  poller = poller or AdaptivePoller()
+  jobs = (_Item(index, model, input)
+          for index, (model, input) in enumerate(jobs))
+  pending = []  # _Items waiting for a scheduler slot
+  running = {}  # Future of a create or reload -> _Item
+  waiting = []  # _Items with a prediction due for a poll at item.due
+  unfinished = set()  # _Items not yielded yet
+
+  def release(item):
+    unfinished.discard(item)
+    if item.ticket is not None:
+      scheduler.release(item.ticket)
+      item.ticket = None
+    if hub is not None and item.prediction is not None:
+      hub.discard(item.prediction.id)
+
+  try:
+    with futures.ThreadPoolExecutor(concurrency) as pool:
+      while True:
+        free = concurrency - len(pending) - len(running) - len(waiting)
+        for item in itertools.islice(jobs, max(free, 0)):
+          pending.append(item)
+          unfinished.add(item)
+        for item in list(pending):
+          if scheduler is not None:
+            item.ticket = scheduler.try_acquire(item.model, priority)
+            if item.ticket is None:
+              continue
+          pending.remove(item)
+          future = pool.submit(_create, client, version_cache, item, webhook)
+          running[future] = item
+        if not pending and not running and not waiting:
+          return
+
+        updated = []
+        now = time.monotonic()
+        for item in list(waiting):
+          payload = hub.wait(item.prediction.id, 0) if hub else None
+          if payload is not None:
+            for field in WEBHOOK_FIELDS:
+              if field in payload:
+                setattr(item.prediction, field, payload[field])
+            waiting.remove(item)
+            updated.append(item)
+          elif item.due <= now:
+            waiting.remove(item)
+            running[pool.submit(_reload, item.prediction)] = item
+
+        if not updated:
+          # Wake for the next poll, and every interval while webhooks or
+          # scheduler slots may turn up
+          timeouts = [item.due - now for item in waiting]
+          if pending or (waiting and hub is not None):
+            timeouts.append(interval)
+          timeout = max(0.0, min(timeouts)) if timeouts else None
+          if running:
+            futures.wait(running, timeout=timeout,
+                         return_when=futures.FIRST_COMPLETED)
+          else:
+            time.sleep(timeout)
+        for future in [f for f in running if f.done()]:
+          item = running.pop(future)
+          try:
+            created = future.result()
+          except Exception as e:
+            if item.prediction is not None:
+              item.failures += 1
+              if item.failures < reload_attempts:
+                # Poll again on the schedule
+                updated.append(item)
+                continue
+              _cancel(item.prediction)
+            release(item)
+            yield item.index, None, e
+            continue
+          item.failures = 0
+          if item.prediction is None:
+            item.prediction = created
+            item.backoff = poller.backoff(item.model,
+                                          webhooks=hub is not None)
+          updated.append(item)
+
+        for item in updated:
+          prediction = item.prediction
+          if prediction.status in TERMINAL_STATUSES:
+            poller.record(item.model, prediction)
+            release(item)
+            yield item.index, prediction, None
+          else:
+            item.due = time.monotonic() + item.backoff.next(prediction.status)
+            waiting.append(item)
+  finally:
+    # The consumer may stop early; the pool has drained by now, so creates
+    # that were still running have their predictions too
+    for future, item in running.items():
+      if item.prediction is None and future.exception() is None:
+        item.prediction = future.result()
+    for item in list(unfinished):
+      if (item.prediction is not None
+          and item.prediction.status not in TERMINAL_STATUSES):
+        _cancel(item.prediction)
+      release(item)
+
+
+def result(index, prediction, error):
+  """Format one run_batch result the way /predict reports it."""
+  if error is None and prediction.status != 'succeeded':
+    error = prediction.error or f'prediction {prediction.status}'
+  if error is not None:
+    return {'index': index, 'error': str(error)}
+  output = prediction.output or []
+  if not isinstance(output, str):
+    output = ''.join(output)
+  return {'index': index, 'response': sentences.trim(output)}
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('path', help='JSONL file of prediction items')
+  parser.add_argument('--concurrency', type=int, default=8)
+  parser.add_argument('--model', default='',
+                      help='model for items that do not name one')
+  args = parser.parse_args()
+
+  from . import main as service
+
+  with open(args.path) as f:
+    items = parse_items(f.read())
+  jobs = ((item.get('model') or args.model,
+           service.make_input(item.get('instruction', ''),
+                              item.get('input', ''))) for item in items)
+  failed = 0
+  for index, prediction, error in run_batch(service.get_client(),
+                                            service.version_cache, jobs,
+                                            concurrency=args.concurrency,
+                                            poller=service.poller):
+    line = result(index, prediction, error)
+    failed += 'error' in line
+    print(json.dumps(line), flush=True)
+  sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+  main()
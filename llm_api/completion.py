@@ -0,0 +1,220 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from replicate.exceptions import ModelError
+
+TERMINAL_STATUSES = ('succeeded', 'failed', 'canceled')
+
+# Fields a webhook payload may update on a Prediction
+WEBHOOK_FIELDS = ('status', 'output', 'error', 'logs', 'started_at',
+                  'completed_at')
+
+
+def parse_timestamp(value):
+  if not value:
+    return None
+  try:
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+  except ValueError:
+    return None
+
+
+class WebhookHub:
+  """Hands prediction updates POSTed by Replicate to the thread waiting on
+  that prediction.
+
+  Payloads that arrive before anyone waits for them (the webhook can beat
+  the create response) are kept for `ttl` seconds. At most `maxsize`
+  predictions are tracked; beyond that the least recently updated one is
+  dropped and its waiter falls back to polling.
+  """
+
+  def __init__(self, ttl=600.0, maxsize=1024):
+    self.ttl = ttl
+    self.maxsize = maxsize
+    self.received = 0
+    self.dropped = 0
+    self._lock = threading.Lock()
+    # id -> (received_at, latest payload or None, Event), oldest first
+    self._entries = OrderedDict()
+
+  def _entry(self, id):
+    entry = self._entries.get(id)
+    if entry is None:
+      entry = self._entries[id] = [time.monotonic(), None, threading.Event()]
+    return entry
+
+  def deliver(self, payload):
+    """Store a prediction payload, raising ValueError if it has no id."""
+    if not isinstance(payload, dict) or not isinstance(payload.get('id'), str):
+      raise ValueError('expected a prediction object with an id')
+    now = time.monotonic()
+    with self._lock:
+      self.received += 1
+      for id in [k for k, e in self._entries.items() if now - e[0] > self.ttl]:
+        del self._entries[id]
+      entry = self._entry(payload['id'])
+      entry[0] = now
+      entry[1] = payload
+      entry[2].set()
+      self._entries.move_to_end(payload['id'])
+      while len(self._entries) > self.maxsize:
+        self._entries.popitem(last=False)
+        self.dropped += 1
+
+  def wait(self, id, timeout):
+    """Return the newest payload for `id` or None after `timeout` seconds."""
+    with self._lock:
+      event = self._entry(id)[2]
+    event.wait(timeout)
+    with self._lock:
+      entry = self._entry(id)
+      payload, entry[1] = entry[1], None
+      entry[2].clear()
+    return payload
+
+  def discard(self, id):
+    with self._lock:
+      self._entries.pop(id, None)
+
+
+class _Backoff:
+  """Delays between the polls of one prediction, see AdaptivePoller."""
+
+  def __init__(self, poller, expected, streaming, webhooks):
+    self.poller = poller
+    self.expected = expected
+    self.streaming = streaming
+    self.webhooks = webhooks
+    self.start = time.monotonic()
+    self.interval = poller.initial
+
+  def next(self, status):
+    """Return how long to wait before polling a prediction in `status`."""
+    poller = self.poller
+    maximum = poller.maximum
+    if self.streaming and status != 'starting':
+      maximum = poller.stream_maximum
+    delay = min(self.interval, maximum)
+    self.interval = min(self.interval * poller.factor, maximum)
+    remaining = 0
+    if self.expected is not None:
+      # Streaming output matters from the moment the model starts,
+      # otherwise only completion does
+      if self.streaming:
+        target = self.expected[0] if status == 'starting' else 0
+      else:
+        target = self.expected[0] + self.expected[1]
+      remaining = target - (time.monotonic() - self.start)
+    if self.webhooks:
+      # A webhook ends the wait as soon as there is news, so the poll is only
+      # a fallback; ending it at the expected moment would race the webhook
+      return max(remaining, 0) + maximum
+    if remaining > delay:
+      delay = min(remaining, maximum)
+      # Poll tightly again around the expected moment
+      self.interval = poller.initial
+    return delay
+
+
+class AdaptivePoller:
+  """Replacement for Prediction.wait() and output_iterator().
+
+  Polling starts every `initial` seconds and backs off by `factor` up to
+  `maximum`, or `stream_maximum` while forwarding streamed output. Queue and
+  run times of past predictions of the same model (from their
+  created_at/started_at/completed_at) are used to sleep through the part of
+  a prediction that is known to take a while. With a
+  WebhookHub, a delivered webhook ends the sleep early and replaces the
+  next GET.
+
+  `backoff` and `record_times` expose the same schedule to callers that
+  poll on their own, such as the asyncio client.
+  """
+
+  def __init__(self, initial=0.05, maximum=2.0, stream_maximum=0.25,
+               factor=1.5, history=True, smoothing=0.2):
+    self.initial = initial
+    self.maximum = maximum
+    self.stream_maximum = stream_maximum
+    self.factor = factor
+    self.history = history
+    self.smoothing = smoothing
+    self._lock = threading.Lock()
+    # model -> [queue seconds, run seconds] moving averages
+    self._durations = {}
+
+  def expected(self, model):
+    """Return (queue, run) seconds expected for `model`, or None."""
+    if not self.history:
+      return None
+    with self._lock:
+      durations = self._durations.get(model)
+      return tuple(durations) if durations else None
+
+  def backoff(self, model, streaming=False, webhooks=False):
+    """Return the poll schedule for a new prediction of `model`.
+
+    With `webhooks`, updates are expected to be pushed and polls only
+    happen `maximum` seconds after the prediction should have finished.
+    """
+    return _Backoff(self, self.expected(model), streaming, webhooks)
+
+  def record(self, model, prediction):
+    self.record_times(model, prediction.created_at, prediction.started_at,
+                      prediction.completed_at)
+
+  def record_times(self, model, created_at, started_at, completed_at):
+    created = parse_timestamp(created_at)
+    started = parse_timestamp(started_at)
+    completed = parse_timestamp(completed_at)
+    if not (created and started and completed):
+      return
+    sample = [(started - created).total_seconds(),
+              (completed - started).total_seconds()]
+    with self._lock:
+      durations = self._durations.get(model)
+      if durations is None:
+        self._durations[model] = sample
+      else:
+        for i, value in enumerate(sample):
+          durations[i] += self.smoothing * (value - durations[i])
+
+  def follow(self, model, prediction, hub=None, streaming=False):
+    """Update `prediction` in place until it finishes, yielding after each
+    update."""
+    backoff = self.backoff(model, streaming, webhooks=hub is not None)
+    try:
+      while prediction.status not in TERMINAL_STATUSES:
+        yield prediction
+        delay = backoff.next(prediction.status)
+        payload = hub.wait(prediction.id, delay) if hub else None
+        if payload is None:
+          if hub is None:
+            time.sleep(delay)
+          prediction.reload()
+        else:
+          for field in WEBHOOK_FIELDS:
+            if field in payload:
+              setattr(prediction, field, payload[field])
+    finally:
+      if hub is not None:
+        hub.discard(prediction.id)
+    self.record(model, prediction)
+    yield prediction
+
+  def wait(self, model, prediction, hub=None):
+    for _ in self.follow(model, prediction, hub):
+      pass
+
+  def output_iterator(self, model, prediction, hub=None):
+    seen = 0
+    for prediction in self.follow(model, prediction, hub, streaming=True):
+      if prediction.status == 'failed':
+        raise ModelError(prediction.error)
+      output = prediction.output or []
+      for chunk in output[seen:]:
+        yield chunk
+      seen = max(seen, len(output))
@@ -0,0 +1,390 @@
+from flask import (Flask, Response, g, has_request_context, jsonify, request,
+                   stream_with_context)
+import replicate
+from replicate.exceptions import ModelError
+import hmac
+import json
+import os
+import time
+
+from . import batch, metrics, sentences
+from .completion import AdaptivePoller, WebhookHub, parse_timestamp
+from .protocol import make_input, sse
+from .result_cache import MemoryBackend, ResultCache, SqliteBackend
+from .scheduler import PRIORITIES, Overloaded, Scheduler
+from .version_cache import VersionCache
+
+_client = None
+_client_pid = None
+
+
+def get_client():
+  # Created on first use in each process rather than at import time: the
+  # client's requests sessions must not be shared across forked workers
+  global _client, _client_pid
+  if _client is None or _client_pid != os.getpid():
+    _client = replicate.Client(api_token=os.environ['replicate_api'])
+    _client.read_session.hooks['response'].append(count_upstream)
+    _client.write_session.hooks['response'].append(count_upstream)
+    _client_pid = os.getpid()
+  return _client
+
+
+version_cache = VersionCache(
+  get_client,
+  ttl=float(os.environ.get('VERSION_CACHE_TTL', '3600')),
+  maxsize=int(os.environ.get('VERSION_CACHE_SIZE', '128')))
+poller = AdaptivePoller(
+  initial=float(os.environ.get('POLL_INITIAL', '0.05')),
+  maximum=float(os.environ.get('POLL_MAX', '2')))
+webhooks = WebhookHub()
+
+# RESULT_CACHE is memory (default), sqlite or off
+result_cache = None
+if os.environ.get('RESULT_CACHE', 'memory') == 'memory':
+  result_cache = ResultCache(MemoryBackend(
+    max_bytes=int(os.environ.get('RESULT_CACHE_BYTES', str(64 * 1024 * 1024)))))
+elif os.environ.get('RESULT_CACHE') == 'sqlite':
+  result_cache = ResultCache(SqliteBackend(
+    os.environ.get('RESULT_CACHE_PATH', 'results.sqlite3'),
+    max_rows=int(os.environ.get('RESULT_CACHE_ROWS', '100000'))))
+if result_cache is not None and 'RESULT_CACHE_TTL' in os.environ:
+  result_cache.ttl = float(os.environ['RESULT_CACHE_TTL'])
+
+# Worker processes sharing the limits below; serve.py sets it for gunicorn
+WORKERS = int(os.environ.get('WEB_CONCURRENCY', '1'))
+scheduler = Scheduler(
+  max_concurrency=int(os.environ.get('MAX_CONCURRENCY', '64')),
+  model_concurrency=int(os.environ.get('MODEL_CONCURRENCY', '16')),
+  model_limits=json.loads(os.environ.get('MODEL_LIMITS', '{}')),
+  max_queue=int(os.environ.get('MAX_QUEUE', '128')),
+  model_max_queue=int(os.environ.get('MODEL_MAX_QUEUE', '32')),
+  queue_timeout=float(os.environ.get('QUEUE_TIMEOUT', '10')),
+  workers=WORKERS)
+
+# Public URL of /webhooks/replicate; when set, Replicate pushes prediction
+# updates there and polling becomes a fallback
+WEBHOOK_URL = os.environ.get('WEBHOOK_URL')
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET')
+if WEBHOOK_URL and not WEBHOOK_SECRET:
+  raise RuntimeError('WEBHOOK_URL requires WEBHOOK_SECRET, or anyone could '
+                     'post prediction updates')
+if WORKERS > 1:
+  # A delivery reaches whichever worker accepts it, rarely the one waiting,
+  # and polls back off far while webhooks are expected
+  WEBHOOK_URL = None
+
+BATCH_MAX_CONCURRENCY = int(os.environ.get('BATCH_MAX_CONCURRENCY', '16'))
+
+# A directory shared by the workers, so /metrics reports all of them;
+# serve.py sets it for gunicorn
+registry = metrics.Registry(os.environ.get('METRICS_DIR'))
+registry.describe('llm_api_stage_seconds', 'histogram',
+                  'Time spent in each stage of a prediction.')
+registry.describe('llm_api_request_seconds', 'histogram',
+                  'HTTP request duration, including streamed bodies.')
+registry.describe('llm_api_requests_total', 'counter',
+                  'HTTP requests by endpoint and status.')
+registry.describe('llm_api_in_flight_requests', 'gauge',
+                  'HTTP requests currently being served.')
+registry.describe('llm_api_upstream_responses_total', 'counter',
+                  'Replicate API responses, including retried ones.')
+registry.describe('llm_api_upstream_errors_total', 'counter',
+                  'Replicate API error responses, including retried ones.')
+for name, type, help in [
+  ('llm_api_version_cache_hits_total', 'counter', 'Version cache hits.'),
+  ('llm_api_version_cache_misses_total', 'counter', 'Version cache misses.'),
+  ('llm_api_result_cache_hits_total', 'counter',
+   'Result cache hits, including coalesced requests.'),
+  ('llm_api_result_cache_misses_total', 'counter', 'Result cache misses.'),
+  ('llm_api_result_cache_bypassed_total', 'counter',
+   'Requests that skipped the result cache.'),
+  ('llm_api_result_cache_bytes', 'gauge', 'Size of cached results.'),
+  ('llm_api_scheduler_running', 'gauge', 'Predictions holding a slot.'),
+  ('llm_api_scheduler_queued', 'gauge', 'Requests waiting for a slot.'),
+  ('llm_api_scheduler_rejected_total', 'counter',
+   'Requests rejected with 503.'),
+  ('llm_api_webhooks_received_total', 'counter', 'Webhooks received.'),
+]:
+  registry.describe(name, type, help)
+
+
+@registry.collect
+def collect_stats():
+  versions = version_cache.stats()
+  yield 'llm_api_version_cache_hits_total', {}, versions['hits']
+  yield 'llm_api_version_cache_misses_total', {}, versions['misses']
+  if result_cache is not None:
+    results = result_cache.stats()
+    yield ('llm_api_result_cache_hits_total', {},
+           results['hits'] + results['coalesced'])
+    yield 'llm_api_result_cache_misses_total', {}, results['misses']
+    yield 'llm_api_result_cache_bypassed_total', {}, results['bypassed']
+    yield 'llm_api_result_cache_bytes', {}, results['bytes']
+  slots = scheduler.stats()
+  yield 'llm_api_scheduler_running', {}, slots['running']
+  yield 'llm_api_scheduler_queued', {}, slots['queued']
+  yield ('llm_api_scheduler_rejected_total', {},
+         slots['rejected'] + slots['timed_out'])
+  yield 'llm_api_webhooks_received_total', {}, webhooks.received
+
+
+def count_upstream(response, *args, **kwargs):
+  # Responses urllib3 retried (429s, 5xx) only show up in the retry history
+  retries = getattr(response.raw, 'retries', None)
+  statuses = [h.status for h in retries.history if h.status] if retries else []
+  statuses.append(response.status_code)
+  for status in statuses:
+    registry.inc('llm_api_upstream_responses_total',
+                 method=response.request.method, status=str(status))
+    if status >= 400:
+      registry.inc('llm_api_upstream_errors_total', status=str(status))
+
+
+def observe(stage, model, seconds):
+  registry.observe('llm_api_stage_seconds', seconds, stage=stage, model=model)
+  if has_request_context():
+    g.setdefault('timings', []).append((stage, seconds))
+
+
+def observe_prediction(model, prediction):
+  # Queue and generation time as reported by Replicate, and how long after
+  # completion we noticed it
+  created = parse_timestamp(prediction.created_at)
+  started = parse_timestamp(prediction.started_at)
+  completed = parse_timestamp(prediction.completed_at)
+  if created and started:
+    observe('queue', model, (started - created).total_seconds())
+  if started and completed:
+    observe('generation', model, (completed - started).total_seconds())
+  if completed:
+    observe('poll_overshoot', model, max(0.0, time.time() -
+                                         completed.timestamp()))
+
+
+app = Flask(__name__)
+
+
+def endpoint():
+  return request.url_rule.rule if request.url_rule else 'unmatched'
+
+
+@app.before_request
+def start_timer():
+  g.start = time.perf_counter()
+  registry.inc('llm_api_in_flight_requests', endpoint=endpoint())
+
+
+@app.after_request
+def add_server_timing(response):
+  registry.inc('llm_api_requests_total', endpoint=endpoint(),
+               status=str(response.status_code))
+  timings = g.get('timings', [])
+  timings.append(('total', time.perf_counter() - g.start))
+  response.headers['Server-Timing'] = ', '.join(
+    f'{name};dur={seconds * 1000:.1f}' for name, seconds in timings)
+  return response
+
+
+@app.teardown_request
+def stop_timer(exc):
+  # Streamed responses only get here once their body has been sent
+  if 'start' in g:
+    registry.inc('llm_api_in_flight_requests', -1, endpoint=endpoint())
+    registry.observe('llm_api_request_seconds',
+                     time.perf_counter() - g.start, endpoint=endpoint())
+
+
+def webhook_url():
+  separator = '&' if '?' in WEBHOOK_URL else '?'
+  return WEBHOOK_URL + separator + 'secret=' + WEBHOOK_SECRET
+
+
+def run(model, stream=False, **kwargs):
+  # Same as replicate.Client.run, but the version lookup goes through the
+  # cache so a warm call only makes the create request, and completion is
+  # detected by the adaptive poller and webhooks instead of a fixed poll
+  # interval. Output is only iterated while the prediction runs when the
+  # caller streams it.
+  start = time.perf_counter()
+  version, streams = version_cache.get(model)
+  resolved = time.perf_counter()
+  observe('version', model, resolved - start)
+  stream = stream and streams
+  hub = None
+  if WEBHOOK_URL:
+    hub = webhooks
+    kwargs.setdefault('webhook', webhook_url())
+    kwargs.setdefault('webhook_events_filter',
+                      ['output', 'completed'] if stream else ['completed'])
+  prediction = get_client().predictions.create(version=version, **kwargs)
+  observe('create', model, time.perf_counter() - resolved)
+  if stream:
+
+    def output_iterator():
+      yield from poller.output_iterator(model, prediction, hub)
+      observe_prediction(model, prediction)
+
+    return output_iterator()
+
+  poller.wait(model, prediction, hub)
+  observe_prediction(model, prediction)
+  if prediction.status == 'failed':
+    raise ModelError(prediction.error)
+  return prediction.output
+
+
+def prediction_args():
+  user_text = request.args.get('input', '')
+  instruction = request.args.get('instruction', '')
+  model = request.args.get('model', '')
+
+  return model, make_input(instruction, user_text)
+
+
+def priority():
+  # X-Priority: high, normal or low picks the scheduler lane
+  lane = request.headers.get('X-Priority', 'normal').lower()
+  return PRIORITIES.get(lane, PRIORITIES['normal'])
+
+
+@app.errorhandler(Overloaded)
+def overloaded(e):
+  response = jsonify({'error': str(e)})
+  response.status_code = 503
+  response.headers['Retry-After'] = str(e.retry_after)
+  return response
+
+
+@app.route('/predict')
+def predict():
+  model, input = prediction_args()
+  lane = priority()
+
+  def compute():
+    # Cache hits and coalesced requests don't need a slot
+    with scheduler.slot(model, lane):
+      return list(run(model, input=input))
+
+  if result_cache is None:
+    output, cache_status = compute(), 'BYPASS'
+  else:
+    output, cache_status = result_cache.get_or_compute(
+      ResultCache.key(model, input), compute,
+      cache_control=request.headers.get('Cache-Control'))
+
+  # keep only the complete sentences
+  start = time.perf_counter()
+  final_response = sentences.trim(''.join(output))
+  observe('trim', model, time.perf_counter() - start)
+
+  response = jsonify({'response': final_response})
+  response.headers['X-Cache'] = cache_status
+  return response
+
+
+@app.route('/predict/stream')
+def predict_stream():
+  """Server-Sent Events version of /predict.
+
+  Each complete sentence is sent as a `{"text": ...}` event as soon as it is
+  known; concatenating them gives the /predict response.
+  """
+  model, input = prediction_args()
+  ticket = scheduler.acquire(model, priority())
+
+  def generate():
+    buffer = sentences.SentenceBuffer()
+    try:
+      for chunk in run(model, stream=True, input=input):
+        for text in buffer.feed(chunk):
+          yield sse({'text': text})
+      for text in buffer.finish():
+        yield sse({'text': text})
+    except Exception as e:
+      yield sse({'error': str(e)}, event='error')
+      return
+    yield sse({}, event='done')
+
+  response = Response(stream_with_context(generate()),
+                      mimetype='text/event-stream',
+                      headers={'Cache-Control': 'no-cache',
+                               'X-Accel-Buffering': 'no'})
+  # Runs even if the client goes away before the stream starts
+  response.call_on_close(lambda: scheduler.release(ticket))
+  return response
+
+
+@app.route('/predict/batch', methods=['POST'])
+def predict_batch():
+  """Run a JSON array or JSONL body of {instruction, input, model} items.
+
+  Results are streamed back as NDJSON in completion order, each tagged with
+  the index of its item. `?model=` is used for items without a model and
+  `?concurrency=` (capped by BATCH_MAX_CONCURRENCY) limits how many
+  predictions run at once.
+  """
+  try:
+    items = batch.parse_items(request.get_data(as_text=True))
+  except ValueError as e:
+    return jsonify({'error': 'invalid batch: ' + str(e)}), 400
+
+  default_model = request.args.get('model', '')
+  concurrency = min(request.args.get('concurrency', 8, type=int),
+                    BATCH_MAX_CONCURRENCY)
+  jobs = [(item.get('model') or default_model,
+           make_input(item.get('instruction', ''), item.get('input', '')))
+          for item in items]
+
+  lane = priority()
+  hooks = {}
+  if WEBHOOK_URL:
+    hooks = {'hub': webhooks, 'webhook': webhook_url()}
+
+  def generate():
+    for index, prediction, error in batch.run_batch(
+        get_client(), version_cache, jobs, concurrency=max(concurrency, 1),
+        poller=poller, scheduler=scheduler, priority=lane, **hooks):
+      yield json.dumps(batch.result(index, prediction, error)) + '\n'
+
+  return Response(stream_with_context(generate()),
+                  mimetype='application/x-ndjson')
+
+
+def replicate_webhook():
+  if not hmac.compare_digest(request.args.get('secret', '').encode(),
+                             WEBHOOK_SECRET.encode()):
+    return jsonify({'error': 'invalid secret'}), 403
+  try:
+    webhooks.deliver(request.get_json(force=True, silent=True))
+  except ValueError as e:
+    return jsonify({'error': 'invalid webhook: ' + str(e)}), 400
+  return '', 204
+
+
+# Only reachable when webhooks are configured
+if WEBHOOK_URL:
+  app.add_url_rule('/webhooks/replicate', view_func=replicate_webhook,
+                   methods=['POST'])
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+  return Response(registry.render(),
+                  mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+
+@app.route('/stats')
+def stats():
+  return jsonify({
+    'version_cache': version_cache.stats(),
+    'result_cache': result_cache.stats() if result_cache else None,
+    'webhooks_received': webhooks.received,
+    'webhooks_dropped': webhooks.dropped,
+    'scheduler': scheduler.stats(),
+  })
+
+
+# Run the app
+if __name__ == '__main__':
+  app.run(debug=True, host='0.0.0.0')
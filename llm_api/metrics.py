@@ -0,0 +1,210 @@
+"""Metrics rendered in the Prometheus text format.
+
+Each process counts its own numbers. Given a directory shared by the
+workers of a server, each also saves them there every `interval` seconds
+and whenever it answers a scrape, and renders the sum over all workers:
+counters and histograms include workers that have exited, so they never
+go backwards, and gauges only count live ones. Other workers' numbers may
+be up to `interval` seconds old.
+"""
+import bisect
+import glob
+import json
+import logging
+import os
+import threading
+import time
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+log = logging.getLogger(__name__)
+
+
+def _escape(value):
+  return (str(value).replace('\\', '\\\\').replace('"', '\\"')
+          .replace('\n', '\\n'))
+
+
+def _labels(labels, extra=()):
+  pairs = list(labels) + list(extra)
+  if not pairs:
+    return ''
+  return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}'
+
+
+def _number(value):
+  if value == float('inf'):
+    return '+Inf'
+  return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _alive(pid):
+  try:
+    os.kill(pid, 0)
+  except ProcessLookupError:
+    return False
+  except PermissionError:
+    pass
+  return True
+
+
+class _Histogram:
+
+  def __init__(self, buckets, counts=None, sum=0.0):
+    self.counts = list(counts or [0] * (len(buckets) + 1))
+    self.sum = sum
+
+  def add(self, other):
+    self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+    self.sum += other.sum
+
+
+class Registry:
+  """Counters, gauges and histograms keyed by name and label set.
+
+  Collectors registered with `collect` are called at render time and
+  return (name, labels, value) samples for metrics described beforehand;
+  they are how existing stats() dictionaries are exported.
+
+  With a `directory`, numbers are summed across the processes sharing it.
+  """
+
+  def __init__(self, directory=None, interval=1.0):
+    self.directory = directory
+    self.interval = interval
+    self._lock = threading.Lock()
+    self._meta = {}  # name -> (type, help, buckets)
+    self._values = {}  # name -> {labels: number or _Histogram}
+    self._collectors = []
+    self._writer_pid = None
+    if directory is not None:
+      os.register_at_fork(after_in_child=self._forked)
+
+  def _forked(self):
+    # Numbers counted before the fork are the parent's to report
+    self._lock = threading.Lock()
+    for values in self._values.values():
+      values.clear()
+
+  def describe(self, name, type, help, buckets=LATENCY_BUCKETS):
+    self._meta[name] = (type, help, buckets)
+    self._values.setdefault(name, {})
+
+  def collect(self, collector):
+    self._collectors.append(collector)
+    return collector
+
+  def _start_writer(self):
+    # Called with the lock held. Threads don't survive a fork, so each
+    # worker starts its own on first use.
+    if self.directory is None or self._writer_pid == os.getpid():
+      return
+    self._writer_pid = os.getpid()
+    threading.Thread(target=self._write_forever, daemon=True).start()
+
+  def inc(self, name, amount=1, **labels):
+    key = tuple(sorted(labels.items()))
+    with self._lock:
+      self._start_writer()
+      values = self._values[name]
+      values[key] = values.get(key, 0) + amount
+
+  def observe(self, name, value, **labels):
+    key = tuple(sorted(labels.items()))
+    buckets = self._meta[name][2]
+    with self._lock:
+      self._start_writer()
+      histogram = self._values[name].get(key)
+      if histogram is None:
+        histogram = self._values[name][key] = _Histogram(buckets)
+      histogram.counts[bisect.bisect_left(buckets, value)] += 1
+      histogram.sum += value
+
+  def _samples(self):
+    """This process's numbers: name -> {labels: number or _Histogram}."""
+    collected = {}
+    for collector in self._collectors:
+      for name, labels, value in collector():
+        collected.setdefault(name, {})[tuple(sorted(labels.items()))] = value
+    samples = {}
+    with self._lock:
+      for name, (type, help, buckets) in self._meta.items():
+        values = samples[name] = {}
+        for labels, value in self._values[name].items():
+          if type == 'histogram':
+            value = _Histogram(buckets, value.counts, value.sum)
+          values[labels] = value
+        values.update(collected.get(name, {}))
+    return samples
+
+  def _write(self, samples):
+    def dump(value):
+      if isinstance(value, _Histogram):
+        return {'counts': value.counts, 'sum': value.sum}
+      return value
+    data = {name: [[labels, dump(value)] for labels, value in values.items()]
+            for name, values in samples.items()}
+    path = os.path.join(self.directory, f'{os.getpid()}.json')
+    with open(path + '.tmp', 'w') as f:
+      json.dump(data, f)
+    os.replace(path + '.tmp', path)
+
+  def _write_forever(self):
+    while True:
+      time.sleep(self.interval)
+      try:
+        self._write(self._samples())
+      except Exception:
+        log.exception('could not save metrics')
+
+  def _read_all(self):
+    """Sum the numbers every process has saved."""
+    merged = {name: {} for name in self._meta}
+    for path in glob.glob(os.path.join(self.directory, '*.json')):
+      try:
+        pid = int(os.path.basename(path)[:-len('.json')])
+        with open(path) as f:
+          data = json.load(f)
+      except (OSError, ValueError):
+        continue
+      alive = _alive(pid)
+      for name, entries in data.items():
+        if name not in self._meta:
+          continue
+        type, help, buckets = self._meta[name]
+        if type == 'gauge' and not alive:
+          continue
+        values = merged[name]
+        for labels, value in entries:
+          labels = tuple(tuple(pair) for pair in labels)
+          if type != 'histogram':
+            values[labels] = values.get(labels, 0) + value
+          elif labels in values:
+            values[labels].add(_Histogram(buckets, **value))
+          else:
+            values[labels] = _Histogram(buckets, **value)
+    return merged
+
+  def render(self):
+    samples = self._samples()
+    if self.directory is not None:
+      self._write(samples)
+      samples = self._read_all()
+
+    lines = []
+    for name, (type, help, buckets) in self._meta.items():
+      lines.append(f'# HELP {name} {help}')
+      lines.append(f'# TYPE {name} {type}')
+      for labels, value in samples[name].items():
+        if type != 'histogram':
+          lines.append(f'{name}{_labels(labels)} {_number(value)}')
+          continue
+        cumulative = 0
+        for bound, count in zip(buckets + (float('inf'),), value.counts):
+          cumulative += count
+          le = (('le', _number(bound)),)
+          lines.append(f'{name}_bucket{_labels(labels, le)} {cumulative}')
+        lines.append(f'{name}_sum{_labels(labels)} {_number(value.sum)}')
+        lines.append(f'{name}_count{_labels(labels)} {cumulative}')
+    return '\n'.join(lines) + '\n'
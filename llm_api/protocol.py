@@ -0,0 +1,16 @@
+"""Prompt and event formats shared by main.py and async_main.py."""
+import json
+
+
+def make_input(instruction, user_text):
+  prompt = 'instruction: ' + instruction + '\ninput: ' + user_text + '\noutput:'
+
+  return {"prompt": prompt, "max_length": 100}
+
+
+def sse(data, event=None):
+  """Format one server-sent event carrying `data` as JSON."""
+  message = 'data: ' + json.dumps(data) + '\n\n'
+  if event:
+    message = 'event: ' + event + '\n' + message
+  return message
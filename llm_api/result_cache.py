@@ -0,0 +1,236 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class MemoryBackend:
+  """In-process LRU store bounded by the total size of its values."""
+
+  def __init__(self, max_bytes=64 * 1024 * 1024):
+    self.max_bytes = max_bytes
+    self.bytes = 0
+    self._lock = threading.Lock()
+    self._entries = OrderedDict()
+
+  def get(self, key):
+    with self._lock:
+      value = self._entries.get(key)
+      if value is not None:
+        self._entries.move_to_end(key)
+      return value
+
+  def set(self, key, value):
+    if len(value) > self.max_bytes:
+      return
+    with self._lock:
+      old = self._entries.pop(key, None)
+      if old is not None:
+        self.bytes -= len(old)
+      self._entries[key] = value
+      self.bytes += len(value)
+      while self.bytes > self.max_bytes:
+        _, evicted = self._entries.popitem(last=False)
+        self.bytes -= len(evicted)
+
+  def delete(self, key):
+    with self._lock:
+      old = self._entries.pop(key, None)
+      if old is not None:
+        self.bytes -= len(old)
+
+  def stats(self):
+    with self._lock:
+      return {
+        'backend': 'memory',
+        'entries': len(self._entries),
+        'bytes': self.bytes,
+        'max_bytes': self.max_bytes,
+      }
+
+
+class SqliteBackend:
+  """On-disk store that survives restarts, bounded to `max_rows` entries.
+
+  Once full, each write deletes the entries written longest ago. The
+  connection is opened on first use in each process, so the backend can
+  be created before a server forks its workers.
+  """
+
+  def __init__(self, path, max_rows=100000):
+    self.path = path
+    self.max_rows = max_rows
+    self._lock = threading.Lock()
+    self._conn = None
+    self._pid = None
+
+  @property
+  def _db(self):
+    if self._pid != os.getpid():
+      self._conn = sqlite3.connect(self.path, check_same_thread=False)
+      self._pid = os.getpid()
+      with self._conn:
+        self._conn.execute('CREATE TABLE IF NOT EXISTS results '
+                           '(key TEXT PRIMARY KEY, value BLOB NOT NULL)')
+    return self._conn
+
+  def get(self, key):
+    with self._lock:
+      row = self._db.execute('SELECT value FROM results WHERE key = ?',
+                             (key,)).fetchone()
+    return row[0] if row else None
+
+  def set(self, key, value):
+    with self._lock, self._db:
+      self._db.execute('INSERT OR REPLACE INTO results VALUES (?, ?)',
+                       (key, value))
+      # A replaced row is inserted again with the highest rowid, so rowids
+      # order the entries by their last write
+      self._db.execute('DELETE FROM results WHERE rowid <= (SELECT rowid '
+                       'FROM results ORDER BY rowid DESC LIMIT 1 OFFSET ?)',
+                       (self.max_rows,))
+
+  def delete(self, key):
+    with self._lock, self._db:
+      self._db.execute('DELETE FROM results WHERE key = ?', (key,))
+
+  def stats(self):
+    with self._lock:
+      entries, size = self._db.execute(
+        'SELECT COUNT(*), COALESCE(SUM(LENGTH(value)), 0) FROM results'
+      ).fetchone()
+    return {
+      'backend': 'sqlite',
+      'path': self.path,
+      'entries': entries,
+      'bytes': size,
+      'max_rows': self.max_rows,
+    }
+
+
+def cache_policy(cache_control):
+  """Return (lookup, store) for a request's Cache-Control header.
+
+  `no-cache` forces a fresh prediction whose result is still stored,
+  `no-store` bypasses the cache entirely.
+  """
+  directives = {d.strip().lower() for d in (cache_control or '').split(',')}
+  if 'no-store' in directives:
+    return False, False
+  if 'no-cache' in directives:
+    return False, True
+  return True, True
+
+
+class _Call:
+
+  def __init__(self):
+    self.done = threading.Event()
+    self.result = None
+    self.error = None
+
+
+class ResultCache:
+  """Prediction outputs keyed on the model and its full input.
+
+  Identical requests that arrive while the first one is still running wait
+  for its result instead of creating predictions of their own.
+  """
+
+  def __init__(self, backend, ttl=None):
+    self.backend = backend
+    self.ttl = ttl
+    self.hits = 0
+    self.misses = 0
+    self.coalesced = 0
+    self.bypassed = 0
+    self._lock = threading.Lock()
+    self._inflight = {}
+
+  @staticmethod
+  def key(model, input):
+    payload = json.dumps([model, input], sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+  def _load(self, key):
+    value = self.backend.get(key)
+    if value is None:
+      return None
+    entry = json.loads(value)
+    if self.ttl is not None and time.time() - entry['time'] > self.ttl:
+      self.backend.delete(key)
+      return None
+    return entry
+
+  def get_or_compute(self, key, compute, cache_control=None):
+    """Return (output, status) with status one of HIT, MISS or BYPASS."""
+    lookup, store = cache_policy(cache_control)
+    if not lookup:
+      with self._lock:
+        self.bypassed += 1
+      output = compute()
+      if store:
+        self._store(key, output)
+      return output, 'BYPASS'
+
+    entry = self._load(key)
+    if entry is not None:
+      with self._lock:
+        self.hits += 1
+      return entry['output'], 'HIT'
+
+    with self._lock:
+      call = self._inflight.get(key)
+      leader = call is None
+      if leader:
+        call = self._inflight[key] = _Call()
+        self.misses += 1
+      else:
+        self.coalesced += 1
+    if not leader:
+      call.done.wait()
+      if call.error is not None:
+        raise call.error
+      return call.result, 'HIT'
+
+    try:
+      # The previous leader may have stored its result between our lookup
+      # and taking its place in _inflight
+      entry = self._load(key)
+      if entry is not None:
+        with self._lock:
+          self.misses -= 1
+          self.hits += 1
+        call.result = entry['output']
+        return call.result, 'HIT'
+      call.result = compute()
+      self._store(key, call.result)
+      return call.result, 'MISS'
+    except Exception as e:
+      call.error = e
+      raise
+    finally:
+      with self._lock:
+        del self._inflight[key]
+      call.done.set()
+
+  def _store(self, key, output):
+    value = json.dumps({'time': time.time(), 'output': output})
+    self.backend.set(key, value.encode())
+
+  def stats(self):
+    with self._lock:
+      hits = self.hits + self.coalesced
+      lookups = hits + self.misses
+      stats = {
+        'hits': self.hits,
+        'misses': self.misses,
+        'coalesced': self.coalesced,
+        'bypassed': self.bypassed,
+        'hit_rate': hits / lookups if lookups else 0.0,
+      }
+    stats.update(self.backend.stats())
+    return stats
@@ -0,0 +1,197 @@
+import itertools
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+PRIORITIES = {'high': 0, 'normal': 1, 'low': 2}
+
+
+class Overloaded(Exception):
+  """Raised when a request can't be admitted; retry after `retry_after`
+  seconds."""
+
+  def __init__(self, message, retry_after):
+    super().__init__(message)
+    self.retry_after = retry_after
+
+
+class _Ticket:
+
+  def __init__(self, model, priority, seq):
+    self.model = model
+    self.priority = priority
+    self.seq = seq
+    self.event = threading.Event()
+    self.granted = False
+    self.rejected = False
+    self.started = None
+
+  def __lt__(self, other):
+    return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class Scheduler:
+  """Admission control in front of Replicate predictions.
+
+  At most `max_concurrency` predictions run at once, and at most
+  `model_concurrency` (or `model_limits[model]`) per model. Requests over
+  those limits wait in a queue of `max_queue` entries, at most
+  `model_max_queue` of them for any one model, ordered by priority, then
+  arrival. A request for a model with free capacity is admitted at once,
+  whatever is queued for other models. A request is rejected with
+  Overloaded when its queue is full or it has waited `queue_timeout`
+  seconds. A full queue sheds its lowest priority entry to admit a more
+  important request.
+
+  State is per process. Under a server running `workers` processes, each
+  enforces its share of the limits, rounded up, so that together they
+  stay within `workers - 1` of the configured totals. A limit smaller than
+  the number of workers can't be shared that way and raises ValueError.
+  Workers don't borrow from each other: one may answer 503 while another
+  has free slots.
+  """
+
+  def __init__(self, max_concurrency=64, model_concurrency=16,
+               model_limits=None, max_queue=128, queue_timeout=10.0,
+               model_max_queue=None, workers=1):
+    def share(name, limit):
+      if limit < workers:
+        raise ValueError(f'{name} of {limit} is less than the {workers} '
+                         'workers that would share it')
+      return math.ceil(limit / workers)
+    self.workers = workers
+    self.max_concurrency = share('max_concurrency', max_concurrency)
+    self.model_concurrency = share('model_concurrency', model_concurrency)
+    self.model_limits = {model: share(f'limit for {model}', limit)
+                         for model, limit in (model_limits or {}).items()}
+    self.max_queue = share('max_queue', max_queue)
+    self.model_max_queue = share('model_max_queue',
+                                 model_max_queue or max_queue)
+    self.queue_timeout = queue_timeout
+    self.rejected = 0
+    self.timed_out = 0
+    self._lock = threading.Lock()
+    self._seq = itertools.count()
+    self._queue = []
+    self._running = 0
+    self._running_by_model = {}
+    # Moving average of how long a slot is held, for Retry-After
+    self._service_time = 1.0
+
+  def _has_capacity(self, model):
+    limit = self.model_limits.get(model, self.model_concurrency)
+    return (self._running < self.max_concurrency
+            and self._running_by_model.get(model, 0) < limit)
+
+  def _grant(self, ticket):
+    ticket.granted = True
+    ticket.started = time.monotonic()
+    self._running += 1
+    self._running_by_model[ticket.model] = (
+      self._running_by_model.get(ticket.model, 0) + 1)
+    ticket.event.set()
+
+  def _dispatch(self):
+    # Admit queued tickets in priority order; a ticket whose model is at its
+    # limit doesn't block tickets for other models behind it
+    for ticket in sorted(self._queue):
+      if self._running >= self.max_concurrency:
+        break
+      if self._has_capacity(ticket.model):
+        self._queue.remove(ticket)
+        self._grant(ticket)
+
+  def _make_room(self, ticket, queued, limit):
+    # Shed the least important of `queued` for `ticket`, or reject it
+    if len(queued) < limit:
+      return
+    worst = max(queued, default=None)
+    if worst is None or not ticket < worst:
+      self.rejected += 1
+      raise Overloaded('too many queued requests', self.retry_after())
+    self._queue.remove(worst)
+    worst.rejected = True
+    worst.event.set()
+    self.rejected += 1
+
+  def retry_after(self):
+    backlog = len(self._queue) + 1
+    return max(1, math.ceil(self._service_time * backlog /
+                            self.max_concurrency))
+
+  def acquire(self, model, priority=PRIORITIES['normal'], timeout=None):
+    """Wait for a slot for `model` and return the ticket holding it."""
+    if timeout is None:
+      timeout = self.queue_timeout
+    with self._lock:
+      ticket = _Ticket(model, priority, next(self._seq))
+      # Queued tickets for a model only remain while it is at its limit, so
+      # free capacity can be granted without jumping anyone's place
+      if self._has_capacity(model):
+        self._grant(ticket)
+        return ticket
+      self._make_room(ticket, [t for t in self._queue if t.model == model],
+                      self.model_max_queue)
+      self._make_room(ticket, self._queue, self.max_queue)
+      self._queue.append(ticket)
+
+    ticket.event.wait(timeout)
+    with self._lock:
+      if ticket.granted:
+        return ticket
+      if ticket.rejected:
+        raise Overloaded('shed for a higher priority request',
+                         self.retry_after())
+      self._queue.remove(ticket)
+      self.timed_out += 1
+      raise Overloaded('timed out waiting for a slot', self.retry_after())
+
+  def try_acquire(self, model, priority=PRIORITIES['normal']):
+    """Return a ticket for `model` if a slot is free now, else None.
+
+    Never queues, so a caller that can wait, like a batch, doesn't take
+    queue places from requests that can't or get shed as Overloaded.
+    """
+    with self._lock:
+      if not self._has_capacity(model):
+        return None
+      ticket = _Ticket(model, priority, next(self._seq))
+      self._grant(ticket)
+      return ticket
+
+  def release(self, ticket):
+    with self._lock:
+      if not ticket.granted:
+        return
+      ticket.granted = False
+      self._running -= 1
+      self._running_by_model[ticket.model] -= 1
+      if not self._running_by_model[ticket.model]:
+        del self._running_by_model[ticket.model]
+      held = time.monotonic() - ticket.started
+      self._service_time += 0.2 * (held - self._service_time)
+      self._dispatch()
+
+  @contextmanager
+  def slot(self, model, priority=PRIORITIES['normal']):
+    ticket = self.acquire(model, priority)
+    try:
+      yield ticket
+    finally:
+      self.release(ticket)
+
+  def stats(self):
+    with self._lock:
+      return {
+        'workers': self.workers,
+        'running': self._running,
+        'running_by_model': dict(self._running_by_model),
+        'queued': len(self._queue),
+        'max_concurrency': self.max_concurrency,
+        'model_concurrency': self.model_concurrency,
+        'max_queue': self.max_queue,
+        'model_max_queue': self.model_max_queue,
+        'rejected': self.rejected,
+        'timed_out': self.timed_out,
+      }
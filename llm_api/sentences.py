@@ -0,0 +1,53 @@
+import re
+
+# Sentences are separated by whitespace following a newline or terminal
+# punctuation
+BOUNDARY = re.compile(r'(?<=[\n.!?])\s+')
+COMPLETE = re.compile(r'[.!?]$')
+
+
+def trim(text):
+  """Drop any partial sentences that do not end with a punctuation mark."""
+  sentences = BOUNDARY.split(text)
+  sentences = [s for s in sentences if COMPLETE.search(s)]
+  return ' '.join(sentences)
+
+
+class SentenceBuffer:
+  """Incremental version of `trim` for streamed output.
+
+  `feed` returns the complete sentences that became available with the new
+  chunk, `finish` returns whatever is left once the stream ends. Joining
+  every returned piece reproduces `trim` of the whole text; pieces after the
+  first carry their leading ' ' separator.
+  """
+
+  def __init__(self):
+    self._tail = ''
+    self._split = False
+    self._emitted = False
+
+  def feed(self, chunk):
+    text = self._tail + chunk
+    if self._split:
+      # Whitespace continuing the last boundary belongs to that boundary
+      text = text.lstrip()
+    if not text:
+      return []
+    pieces = BOUNDARY.split(text)
+    # The last piece may still grow, everything before it is final
+    self._tail = pieces.pop()
+    self._split = self._split or bool(pieces)
+    return self._keep(pieces)
+
+  def finish(self):
+    pieces, self._tail = [self._tail], ''
+    return self._keep(pieces)
+
+  def _keep(self, pieces):
+    kept = []
+    for s in pieces:
+      if COMPLETE.search(s):
+        kept.append(' ' + s if self._emitted else s)
+        self._emitted = True
+    return kept
@@ -0,0 +1,109 @@
+"""Production entry point: serves main.app under gunicorn.
+
+The app is imported once in the master and forked into pre-started workers
+with debug off. Each worker creates its own Replicate client on first use.
+On SIGTERM, gunicorn stops accepting connections and gives in-flight
+requests up to --graceful-timeout seconds to finish.
+
+Admission limits (MAX_CONCURRENCY, MODEL_CONCURRENCY, MAX_QUEUE, ...) are
+totals for the server and are split evenly between the workers, so none
+may be smaller than --workers. Each worker admits requests on its own and
+may answer 503 while another has room. Webhook
+deliveries would reach whichever worker accepts them, so WEBHOOK_URL is
+ignored with more than one worker.
+
+Workers save their metrics in METRICS_DIR, a fresh temporary directory by
+default, and /metrics on any of them reports the sum over all workers.
+"""
+import argparse
+import glob
+import logging
+import os
+import shutil
+import tempfile
+
+from gunicorn.app.base import BaseApplication
+
+
+ACCESS_LOG_FORMAT = ('%(h)s %(l)s %(u)s %(t)s "%(m)s %(U)s %(H)s" %(s)s %(b)s '
+                     '%(L)s')
+
+
+def default_workers():
+  # Workers only wait on Replicate, so threads carry the concurrency. One
+  # process per core is enough, and fewer processes share caches and
+  # admission limits better.
+  return min(max(2, os.cpu_count() or 1), 8)
+
+
+class Server(BaseApplication):
+
+  def __init__(self, options):
+    self.options = options
+    super().__init__()
+
+  def load_config(self):
+    for key, value in self.options.items():
+      self.cfg.set(key, value)
+
+  def load(self):
+    from . import main
+    main.app.debug = False
+    return main.app
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--bind',
+                      default='0.0.0.0:' + os.environ.get('PORT', '8080'))
+  parser.add_argument('--workers', type=int,
+                      default=int(os.environ.get('WEB_CONCURRENCY', '0'))
+                      or default_workers())
+  parser.add_argument('--threads', type=int,
+                      default=int(os.environ.get('WEB_THREADS', '32')))
+  parser.add_argument('--timeout', type=int, default=120,
+                      help='seconds before a silent worker is restarted')
+  parser.add_argument('--graceful-timeout', type=int, default=60,
+                      help='seconds in-flight requests get on SIGTERM')
+  args = parser.parse_args()
+
+  # main divides the scheduler limits by this when the app is loaded
+  os.environ['WEB_CONCURRENCY'] = str(args.workers)
+  metrics_dir = os.environ.get('METRICS_DIR')
+  created = None
+  if metrics_dir:
+    # Numbers saved by an earlier run's workers would be added to this one's
+    for path in glob.glob(os.path.join(metrics_dir, '*.json')):
+      os.remove(path)
+  else:
+    metrics_dir = os.environ['METRICS_DIR'] = tempfile.mkdtemp(
+      prefix='llm-api-metrics-')
+    created = os.getpid()
+  if os.environ.get('WEBHOOK_URL') and args.workers > 1:
+    logging.warning('WEBHOOK_URL is ignored with %d workers: a webhook only '
+                    'reaches the worker that receives it, so predictions are '
+                    'polled instead', args.workers)
+
+  try:
+    Server({
+      'bind': args.bind,
+      'workers': args.workers,
+      'worker_class': 'gthread',
+      'threads': args.threads,
+      'timeout': args.timeout,
+      'graceful_timeout': args.graceful_timeout,
+      'keepalive': 5,
+      'preload_app': True,
+      'accesslog': '-',
+      # The default format logs the request line with its query string,
+      # which carries prompts and the webhook secret; log the bare path
+      'access_log_format': ACCESS_LOG_FORMAT,
+    }).run()
+  finally:
+    # Workers exit through here too; only the master removes the directory
+    if created == os.getpid():
+      shutil.rmtree(metrics_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,86 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from replicate.exceptions import ReplicateError
+
+
+class VersionCache:
+  """Resolved model versions keyed by owner/name:version.
+
+  Entries expire after `ttl` seconds and the least recently used entry is
+  evicted once `maxsize` is reached. Concurrent lookups of a cold key share
+  a single API request. `get_client` returns the replicate.Client to use.
+  """
+
+  def __init__(self, get_client, ttl=3600.0, maxsize=128):
+    self.get_client = get_client
+    self.ttl = ttl
+    self.maxsize = maxsize
+    self.hits = 0
+    self.misses = 0
+    self._lock = threading.Lock()
+    # key -> (expires_at, version, streams)
+    self._entries = OrderedDict()
+    # key -> Event set once the leading lookup finishes
+    self._inflight = {}
+
+  def get(self, model_version):
+    """Return (version, streams) where streams is True for iterator outputs."""
+    while True:
+      with self._lock:
+        entry = self._entries.get(model_version)
+        if entry is not None and entry[0] > time.monotonic():
+          self._entries.move_to_end(model_version)
+          self.hits += 1
+          return entry[1], entry[2]
+        waiter = self._inflight.get(model_version)
+        if waiter is None:
+          waiter = self._inflight[model_version] = threading.Event()
+          self.misses += 1
+          break
+      # Another thread is already looking this key up; retry once it's done
+      waiter.wait()
+
+    try:
+      version, streams = self._lookup(model_version)
+      with self._lock:
+        self._entries[model_version] = (time.monotonic() + self.ttl, version,
+                                        streams)
+        self._entries.move_to_end(model_version)
+        while len(self._entries) > self.maxsize:
+          self._entries.popitem(last=False)
+      return version, streams
+    finally:
+      with self._lock:
+        del self._inflight[model_version]
+      waiter.set()
+
+  def _lookup(self, model_version):
+    m = re.match(r'^(?P<model>[^/]+/[^:]+):(?P<version>.+)$', model_version)
+    if not m:
+      raise ReplicateError(
+        f'Invalid model_version: {model_version}. Expected format: owner/name:version'
+      )
+    model = self.get_client().models.get(m.group('model'))
+    version = model.versions.get(m.group('version'))
+    schema = version.get_transformed_schema()
+    output = schema['components']['schemas']['Output']
+    streams = (output.get('type') == 'array'
+               and output.get('x-cog-array-type') == 'iterator')
+    return version, streams
+
+  def clear(self):
+    with self._lock:
+      self._entries.clear()
+
+  def stats(self):
+    with self._lock:
+      return {
+        'hits': self.hits,
+        'misses': self.misses,
+        'size': len(self._entries),
+        'maxsize': self.maxsize,
+        'ttl': self.ttl,
+      }
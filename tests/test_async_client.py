@@ -0,0 +1,126 @@
+import asyncio
+
+import pytest
+from aiohttp import web
+from replicate.exceptions import ReplicateError
+
+import fake_replicate
+from llm_api.async_client import AsyncReplicate
+from llm_api.completion import AdaptivePoller
+
+MODEL = 'fake/model:v1'
+
+
+def poller():
+  return AdaptivePoller(initial=0.001, maximum=0.01, history=False)
+
+
+async def serve(app):
+  runner = web.AppRunner(app)
+  await runner.setup()
+  site = web.TCPSite(runner, '127.0.0.1', 0)
+  await site.start()
+  return runner, f'http://127.0.0.1:{runner.addresses[0][1]}'
+
+
+async def with_client(base_url, test, **kwargs):
+  client = AsyncReplicate('token', base_url=base_url, poller=poller(),
+                          backoff=0, **kwargs)
+  try:
+    return await test(client)
+  finally:
+    await client.close()
+
+
+def run_fake(fake, test, **kwargs):
+  async def main():
+    runner, url = await fake_replicate.start(fake)
+    try:
+      return await with_client(url, test, **kwargs)
+    finally:
+      await runner.cleanup()
+  return asyncio.run(main())
+
+
+async def collect(client, model=MODEL):
+  return [chunk async for chunk in client.run(model, {'prompt': 'x'})]
+
+
+def test_run_streams_the_output():
+  fake = fake_replicate.FakeReplicate(token_delay=0.001)
+  assert run_fake(fake, collect) == fake.tokens
+  assert fake.calls['version'] == fake.calls['create'] == 1
+
+
+def test_throttled_requests_are_retried():
+  fake = fake_replicate.FakeReplicate(token_delay=0.001, throttle_rate=0.5,
+                                      retry_after=0, seed=1)
+  assert run_fake(fake, collect) == fake.tokens
+  assert fake.calls['throttled'] > 0
+  assert fake.calls['create'] == 1
+
+
+def test_retries_are_bounded():
+  fake = fake_replicate.FakeReplicate(throttle_rate=1.0, retry_after=0)
+  with pytest.raises(ReplicateError):
+    run_fake(fake, collect, retries=2)
+  assert fake.calls['throttled'] == 3
+
+
+def test_server_errors_are_retried_for_gets_only():
+  calls = {'GET': 0, 'POST': 0}
+
+  async def unavailable(request):
+    calls[request.method] += 1
+    if calls[request.method] < 3:
+      return web.json_response({'detail': 'try again'}, status=503)
+    return web.json_response({'id': 'p1'})
+
+  async def main():
+    app = web.Application()
+    app.router.add_route('*', '/v1/predictions/{id}', unavailable)
+    runner, url = await serve(app)
+
+    async def test(client):
+      assert (await client.get_prediction('p1'))['id'] == 'p1'
+      with pytest.raises(ReplicateError, match='try again'):
+        await client._request('POST', '/v1/predictions/p1')
+    try:
+      await with_client(url, test)
+    finally:
+      await runner.cleanup()
+  asyncio.run(main())
+  assert calls == {'GET': 3, 'POST': 1}
+
+
+def test_retry_after_is_honoured():
+  client = AsyncReplicate.__new__(AsyncReplicate)
+  client.backoff = 0.5
+  assert client._retry_delay('3', 0) == 3.0
+  assert client._retry_delay(None, 2) == 2.0
+  assert client._retry_delay('soon', 0) == 0.5
+  assert client._retry_delay('3600', 0) == 60.0
+
+
+def test_old_cog_array_outputs_stream():
+  # Before cog 0.3.9 schemas had no x-cog-array-type, and every array
+  # output was an iterator
+  async def version(request):
+    return web.json_response({
+      'id': 'v1',
+      'cog_version': '0.3.0',
+      'openapi_schema': {'components': {'schemas': {'Output': {
+        'type': 'array', 'items': {'type': 'string'}}}}},
+    })
+
+  async def main():
+    app = web.Application()
+    app.router.add_get('/v1/models/{owner}/{name}/versions/{version}',
+                       version)
+    runner, url = await serve(app)
+    try:
+      return await with_client(url, lambda client: client.get_version(MODEL))
+    finally:
+      await runner.cleanup()
+  _, streams = asyncio.run(main())
+  assert streams
@@ -0,0 +1,53 @@
+import asyncio
+import json
+
+from aiohttp.test_utils import TestClient, TestServer
+
+import fake_replicate
+from llm_api import async_main
+
+
+def get(monkeypatch, path, fake):
+  monkeypatch.setenv('POLL_INITIAL', '0.001')
+  monkeypatch.setenv('POLL_MAX', '0.01')
+
+  async def main():
+    runner, url = await fake_replicate.start(fake)
+    monkeypatch.setenv('REPLICATE_API_BASE_URL', url)
+    try:
+      async with TestClient(TestServer(async_main.make_app('token'))) as app:
+        resp = await app.get(path, params={'model': 'fake/model:v1',
+                                           'input': 'hi'})
+        return resp.status, await resp.text()
+    finally:
+      await runner.cleanup()
+  return asyncio.run(main())
+
+
+def events(body):
+  for block in body.strip().split('\n\n'):
+    fields = dict(line.split(': ', 1) for line in block.splitlines())
+    yield fields.get('event', 'message'), json.loads(fields['data'])
+
+
+def test_predict_returns_complete_sentences(monkeypatch):
+  fake = fake_replicate.FakeReplicate(token_delay=0.001)
+  status, body = get(monkeypatch, '/predict', fake)
+  assert status == 200
+  assert json.loads(body) == {'response': 'Hello there. This is a fake model.'}
+
+
+def test_predict_stream_sends_sentences_then_done(monkeypatch):
+  fake = fake_replicate.FakeReplicate(token_delay=0.001)
+  status, body = get(monkeypatch, '/predict/stream', fake)
+  assert status == 200
+  sent = list(events(body))
+  assert sent[-1] == ('done', {})
+  assert ''.join(data['text'] for _, data in sent[:-1]) == (
+    'Hello there. This is a fake model.')
+
+
+def test_predict_stream_reports_failures(monkeypatch):
+  fake = fake_replicate.FakeReplicate(token_delay=0.001, error_rate=1.0)
+  _, body = get(monkeypatch, '/predict/stream', fake)
+  assert list(events(body))[-1] == ('error', {'error': 'fake failure'})
@@ -0,0 +1,155 @@
+import threading
+
+import pytest
+from replicate.exceptions import ReplicateError
+
+from llm_api import batch
+from llm_api.completion import AdaptivePoller
+from llm_api.scheduler import Scheduler
+
+
+def test_parse_json_array_and_jsonl():
+  items = [{'instruction': 'i', 'input': 'x'}, {'model': 'a/a:v'}]
+  assert batch.parse_items('[{"instruction": "i", "input": "x"}, '
+                           '{"model": "a/a:v"}]') == items
+  assert batch.parse_items('{"instruction": "i", "input": "x"}\n\n'
+                           '{"model": "a/a:v"}\n') == items
+
+
+@pytest.mark.parametrize('body', [
+  '[1]',
+  '{"input": 5}',
+  '[{"instruction": null}]',
+  '{"input": "x"}\n{"model": ["a/a:v"]}',
+  '{"input": ',
+])
+def test_parse_rejects_invalid_items(body):
+  with pytest.raises(ValueError):
+    batch.parse_items(body)
+
+
+class FakePrediction:
+
+  def __init__(self, client, id, polls):
+    self.client = client
+    self.id = id
+    self.polls = polls
+    self.status = 'starting'
+    self.output = None
+    self.error = None
+    self.created_at = self.started_at = self.completed_at = None
+
+  def reload(self):
+    client = self.client
+    with client.lock:
+      client.reloads += 1
+      if client.reload_errors:
+        client.reload_errors -= 1
+        raise ReplicateError('temporarily unavailable')
+    self.polls -= 1
+    if self.polls > 0:
+      self.status = 'processing'
+    else:
+      self.status = 'succeeded'
+      self.output = ['Done.']
+
+  def cancel(self):
+    with self.client.lock:
+      self.client.canceled.append(self.id)
+    self.status = 'canceled'
+
+
+class FakeClient:
+  """Stands in for replicate.Client; input['polls'] sets how many reloads a
+  prediction takes to finish."""
+
+  def __init__(self, reload_errors=0):
+    self.predictions = self
+    self.lock = threading.Lock()
+    self.created = 0
+    self.reloads = 0
+    self.reload_errors = reload_errors
+    self.canceled = []
+
+  def create(self, version, input, **kwargs):
+    with self.lock:
+      self.created += 1
+      id = f'p{self.created}'
+    return FakePrediction(self, id, input.get('polls', 2))
+
+
+class FakeVersionCache:
+
+  def get(self, model):
+    return None, False
+
+
+def run(client, jobs, **kwargs):
+  poller = AdaptivePoller(initial=0.001, maximum=0.005, history=False)
+  return batch.run_batch(client, FakeVersionCache(), jobs, poller=poller,
+                         **kwargs)
+
+
+def test_run_batch_finishes_every_job():
+  client = FakeClient()
+  jobs = [('a/a:v', {'polls': i % 3 + 1}) for i in range(20)]
+  results = list(run(client, jobs, concurrency=4))
+  assert sorted(index for index, _, _ in results) == list(range(20))
+  assert all(error is None and prediction.status == 'succeeded'
+             for _, prediction, error in results)
+  assert client.created == 20
+  assert client.canceled == []
+
+
+def test_run_batch_retries_failed_reloads():
+  client = FakeClient(reload_errors=3)
+  results = list(run(client, [('a/a:v', {'polls': 2})], reload_attempts=5))
+  assert [error for _, _, error in results] == [None]
+  assert client.reloads == 5
+  assert client.canceled == []
+
+
+def test_run_batch_cancels_predictions_it_gives_up_on():
+  client = FakeClient(reload_errors=100)
+  scheduler = Scheduler()
+  results = list(run(client, [('a/a:v', {'polls': 2})], reload_attempts=3,
+                     scheduler=scheduler))
+  [(index, prediction, error)] = results
+  assert isinstance(error, ReplicateError)
+  assert client.reloads == 3
+  assert client.canceled == ['p1']
+  assert scheduler.stats()['running'] == 0
+
+
+def test_stopping_early_cancels_running_predictions():
+  client = FakeClient()
+  scheduler = Scheduler()
+  jobs = [('a/a:v', {'polls': 1})] + [('a/a:v', {'polls': 10 ** 6})] * 3
+  results = run(client, jobs, concurrency=4, scheduler=scheduler)
+  index, prediction, error = next(results)
+  assert index == 0 and error is None
+  results.close()
+  assert sorted(client.canceled) == ['p2', 'p3', 'p4']
+  assert scheduler.stats()['running'] == 0
+
+
+def test_run_batch_waits_for_scheduler_slots():
+  # Each of 8 workers gets 2 of the default 16 slots per model
+  scheduler = Scheduler(workers=8)
+  client = FakeClient()
+  peak = []
+  create = client.create
+
+  def create_and_count(version, input, **kwargs):
+    peak.append(scheduler.stats()['running'])
+    return create(version, input, **kwargs)
+  client.create = create_and_count
+
+  jobs = [('a/a:v', {'polls': 2})] * 40
+  results = list(run(client, jobs, concurrency=16, scheduler=scheduler,
+                     interval=0.001))
+  assert all(error is None for _, _, error in results)
+  assert client.created == 40
+  assert max(peak) <= 2
+  stats = scheduler.stats()
+  assert (stats['running'], stats['rejected'], stats['queued']) == (0, 0, 0)
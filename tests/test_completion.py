@@ -0,0 +1,55 @@
+import pytest
+
+from llm_api.completion import AdaptivePoller, WebhookHub
+
+
+@pytest.mark.parametrize('payload', [None, [1], {'status': 'succeeded'},
+                                     {'id': 5}])
+def test_deliver_rejects_payloads_without_an_id(payload):
+  hub = WebhookHub()
+  with pytest.raises(ValueError):
+    hub.deliver(payload)
+
+
+def test_deliver_wakes_the_waiter():
+  hub = WebhookHub()
+  hub.deliver({'id': 'p1', 'status': 'succeeded'})
+  assert hub.wait('p1', 0) == {'id': 'p1', 'status': 'succeeded'}
+  assert hub.wait('p1', 0) is None
+
+
+def test_backoff_grows_to_the_maximum():
+  poller = AdaptivePoller(initial=0.1, maximum=0.3, factor=2, history=False)
+  backoff = poller.backoff('a/a:v')
+  delays = [backoff.next('processing') for _ in range(4)]
+  assert delays == pytest.approx([0.1, 0.2, 0.3, 0.3])
+
+
+def test_backoff_sleeps_through_the_expected_duration():
+  poller = AdaptivePoller(initial=0.1, maximum=5.0)
+  poller.record_times('a/a:v', '2023-01-01T00:00:00Z',
+                      '2023-01-01T00:00:01Z', '2023-01-01T00:00:03Z')
+  assert poller.expected('a/a:v') == (1.0, 2.0)
+  delay = poller.backoff('a/a:v').next('starting')
+  assert 2.9 < delay <= 3.0
+  # A streamed prediction only waits for the model to start
+  delay = poller.backoff('a/a:v', streaming=True).next('starting')
+  assert 0.9 < delay <= 1.0
+
+
+def test_backoff_with_webhooks_polls_well_after_the_expected_end():
+  poller = AdaptivePoller(initial=0.1, maximum=2.0)
+  assert poller.backoff('a/a:v', webhooks=True).next('starting') == 2.0
+  poller.record_times('a/a:v', '2023-01-01T00:00:00Z',
+                      '2023-01-01T00:00:01Z', '2023-01-01T00:00:03Z')
+  delay = poller.backoff('a/a:v', webhooks=True).next('starting')
+  assert 4.9 < delay <= 5.0
+
+
+def test_hub_drops_the_oldest_entries_beyond_maxsize():
+  hub = WebhookHub(maxsize=2)
+  for id in ['p1', 'p2', 'p3']:
+    hub.deliver({'id': id})
+  assert hub.dropped == 1
+  assert hub.wait('p1', 0) is None
+  assert hub.wait('p3', 0) == {'id': 'p3'}
@@ -0,0 +1,43 @@
+from types import SimpleNamespace
+
+from llm_api import main
+
+
+def upstream_counts():
+  counts = {}
+  for name in ['llm_api_upstream_responses_total',
+               'llm_api_upstream_errors_total']:
+    for labels, value in main.registry._values[name].items():
+      counts[name, labels] = value
+  return counts
+
+
+def response(method, status, history=None):
+  retries = None
+  if history is not None:
+    retries = SimpleNamespace(history=[SimpleNamespace(status=status)
+                                       for status in history])
+  return SimpleNamespace(status_code=status,
+                         request=SimpleNamespace(method=method),
+                         raw=SimpleNamespace(retries=retries))
+
+
+def test_count_upstream_includes_retried_responses():
+  before = upstream_counts()
+  # A connection error leaves a history entry without a status
+  main.count_upstream(response('GET', 200, history=[429, None, 503]))
+  main.count_upstream(response('POST', 201))
+  after = upstream_counts()
+  added = {key: value - before.get(key, 0) for key, value in after.items()
+           if value != before.get(key, 0)}
+
+  responses = 'llm_api_upstream_responses_total'
+  errors = 'llm_api_upstream_errors_total'
+  assert added == {
+    (responses, (('method', 'GET'), ('status', '429'))): 1,
+    (responses, (('method', 'GET'), ('status', '503'))): 1,
+    (responses, (('method', 'GET'), ('status', '200'))): 1,
+    (responses, (('method', 'POST'), ('status', '201'))): 1,
+    (errors, (('status', '429'),)): 1,
+    (errors, (('status', '503'),)): 1,
+  }
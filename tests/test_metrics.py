@@ -0,0 +1,92 @@
+import multiprocessing
+
+from llm_api import metrics
+
+
+def samples(registry):
+  lines = registry.render().splitlines()
+  return dict(line.rsplit(' ', 1) for line in lines
+              if not line.startswith('#'))
+
+
+def make_registry(directory=None):
+  registry = metrics.Registry(directory)
+  registry.describe('requests_total', 'counter', 'Requests.')
+  registry.describe('in_flight', 'gauge', 'Requests being served.')
+  registry.describe('seconds', 'histogram', 'Durations.', buckets=(0.1, 1.0))
+  return registry
+
+
+def test_render_counters_and_gauges():
+  registry = make_registry()
+  registry.inc('requests_total', endpoint='/predict', status='200')
+  registry.inc('requests_total', 2, status='200', endpoint='/predict')
+  registry.inc('in_flight', endpoint='/a"b\\')
+  text = registry.render()
+  assert '# TYPE requests_total counter' in text
+  assert samples(registry) == {
+    'requests_total{endpoint="/predict",status="200"}': '3',
+    'in_flight{endpoint="/a\\"b\\\\"}': '1',
+  }
+
+
+def test_histogram_buckets_are_cumulative():
+  registry = make_registry()
+  for value in [0.05, 0.1, 0.5, 5.0]:
+    registry.observe('seconds', value, stage='queue')
+  assert samples(registry) == {
+    'seconds_bucket{stage="queue",le="0.1"}': '2',
+    'seconds_bucket{stage="queue",le="1.0"}': '3',
+    'seconds_bucket{stage="queue",le="+Inf"}': '4',
+    'seconds_sum{stage="queue"}': '5.65',
+    'seconds_count{stage="queue"}': '4',
+  }
+
+
+def test_collectors_are_called_at_render_time():
+  registry = make_registry()
+  stats = {'running': 0}
+
+  @registry.collect
+  def collect():
+    yield 'in_flight', {}, stats['running']
+  assert callable(collect)
+  stats['running'] = 4
+  assert samples(registry) == {'in_flight': '4'}
+
+
+def test_processes_sharing_a_directory_are_summed(tmp_path):
+  registry = make_registry(str(tmp_path))
+  registry.inc('requests_total')
+  registry.inc('in_flight')
+  registry.observe('seconds', 0.05)
+
+  def worker():
+    registry.inc('requests_total', 2)
+    registry.inc('in_flight', 5)
+    registry.observe('seconds', 0.5)
+    registry.render()
+    rendered.set()
+    done.wait(5)
+
+  context = multiprocessing.get_context('fork')
+  rendered, done = context.Event(), context.Event()
+  child = context.Process(target=worker)
+  child.start()
+  try:
+    assert rendered.wait(5)
+    # The child starts from zero rather than the numbers it forked with
+    live = samples(registry)
+    assert live['requests_total'] == '3'
+    assert live['in_flight'] == '6'
+    assert live['seconds_bucket{le="0.1"}'] == '1'
+    assert live['seconds_count'] == '2'
+  finally:
+    done.set()
+    child.join(5)
+
+  # An exited worker's counters still count, but its gauges don't
+  exited = samples(registry)
+  assert exited['requests_total'] == '3'
+  assert exited['in_flight'] == '1'
+  assert exited['seconds_count'] == '2'
@@ -0,0 +1,172 @@
+import threading
+import time
+
+import pytest
+
+from llm_api.result_cache import (MemoryBackend, ResultCache, SqliteBackend,
+                                  cache_policy)
+
+
+def slow(result, started, release):
+  def compute():
+    started.set()
+    assert release.wait(2)
+    if isinstance(result, Exception):
+      raise result
+    return result
+  return compute
+
+
+def follow(cache, key, results):
+  def run():
+    try:
+      results.append(cache.get_or_compute(key, lambda: 'not coalesced'))
+    except Exception as e:
+      results.append(e)
+  thread = threading.Thread(target=run)
+  thread.start()
+  return thread
+
+
+def wait_for_followers(cache, n):
+  deadline = time.monotonic() + 2
+  while cache.stats()['coalesced'] < n:
+    assert time.monotonic() < deadline, 'timed out'
+    time.sleep(0.001)
+
+
+def test_followers_share_the_leaders_result():
+  cache = ResultCache(MemoryBackend())
+  key = cache.key('a/a:v', {'prompt': 'x'})
+  started, release = threading.Event(), threading.Event()
+  leader = []
+  thread = threading.Thread(target=lambda: leader.append(
+    cache.get_or_compute(key, slow('out', started, release))))
+  thread.start()
+  assert started.wait(2)
+
+  results = []
+  followers = [follow(cache, key, results) for _ in range(3)]
+  wait_for_followers(cache, 3)
+  release.set()
+  for t in [thread] + followers:
+    t.join(2)
+
+  assert leader == [('out', 'MISS')]
+  assert results == [('out', 'HIT')] * 3
+  assert cache.get_or_compute(key, lambda: 'recomputed') == ('out', 'HIT')
+  stats = cache.stats()
+  assert (stats['misses'], stats['coalesced'], stats['hits']) == (1, 3, 1)
+
+
+def test_leader_error_propagates_and_is_not_cached():
+  cache = ResultCache(MemoryBackend())
+  key = cache.key('a/a:v', {'prompt': 'x'})
+  started, release = threading.Event(), threading.Event()
+  error = RuntimeError('prediction failed')
+  leader = []
+
+  def lead():
+    try:
+      cache.get_or_compute(key, slow(error, started, release))
+    except RuntimeError as e:
+      leader.append(e)
+  thread = threading.Thread(target=lead)
+  thread.start()
+  assert started.wait(2)
+
+  results = []
+  followers = [follow(cache, key, results) for _ in range(2)]
+  wait_for_followers(cache, 2)
+  release.set()
+  for t in [thread] + followers:
+    t.join(2)
+
+  assert leader == [error]
+  assert results == [error, error]
+  assert cache.get_or_compute(key, lambda: 'retried') == ('retried', 'MISS')
+
+
+@pytest.mark.parametrize('header, policy', [
+  (None, (True, True)),
+  ('max-age=0', (True, True)),
+  ('no-cache', (False, True)),
+  ('No-Cache, max-age=0', (False, True)),
+  ('no-store', (False, False)),
+  ('no-cache, no-store', (False, False)),
+])
+def test_cache_policy(header, policy):
+  assert cache_policy(header) == policy
+
+
+def test_cache_control_bypass():
+  cache = ResultCache(MemoryBackend())
+  key = cache.key('a/a:v', {'prompt': 'x'})
+  cache.get_or_compute(key, lambda: 'first')
+  assert cache.get_or_compute(key, lambda: 'second', 'no-store') == (
+    'second', 'BYPASS')
+  assert cache.get_or_compute(key, lambda: 'third') == ('first', 'HIT')
+  assert cache.get_or_compute(key, lambda: 'fourth', 'no-cache') == (
+    'fourth', 'BYPASS')
+  assert cache.get_or_compute(key, lambda: 'fifth') == ('fourth', 'HIT')
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+  now = [1000.0]
+  monkeypatch.setattr(time, 'time', lambda: now[0])
+  cache = ResultCache(MemoryBackend(), ttl=60)
+  key = cache.key('a/a:v', {'prompt': 'x'})
+  cache.get_or_compute(key, lambda: 'old')
+  now[0] += 59
+  assert cache.get_or_compute(key, lambda: 'new') == ('old', 'HIT')
+  now[0] += 2
+  assert cache.get_or_compute(key, lambda: 'new') == ('new', 'MISS')
+
+
+def test_memory_backend_evicts_least_recently_used_bytes():
+  backend = MemoryBackend(max_bytes=10)
+  backend.set('a', b'1234')
+  backend.set('b', b'1234')
+  assert backend.get('a') == b'1234'
+  backend.set('c', b'1234')
+  assert backend.get('b') is None
+  assert backend.get('a') == backend.get('c') == b'1234'
+  assert backend.stats()['bytes'] == 8
+
+  # Values larger than the whole cache are not stored
+  backend.set('d', b'x' * 11)
+  assert backend.get('d') is None
+  assert backend.stats()['entries'] == 2
+
+
+def test_sqlite_backend_keeps_the_latest_rows(tmp_path):
+  backend = SqliteBackend(str(tmp_path / 'results.sqlite3'), max_rows=2)
+  backend.set('a', b'1')
+  backend.set('b', b'2')
+  backend.set('a', b'3')
+  backend.set('c', b'4')
+  assert backend.get('b') is None
+  assert backend.get('a') == b'3'
+  assert backend.get('c') == b'4'
+  assert backend.stats()['entries'] == 2
+
+
+def test_leader_rechecks_results_stored_after_its_lookup():
+  cache = ResultCache(MemoryBackend())
+  key = cache.key('a/a:v', {'prompt': 'x'})
+  load = cache._load
+  misses = []
+
+  def load_then_finish_other_leader(key):
+    entry = load(key)
+    if not misses:
+      # Another request stores its result right after this lookup missed
+      misses.append(entry)
+      cache._store(key, 'first')
+    return entry
+  cache._load = load_then_finish_other_leader
+
+  assert cache.get_or_compute(key, lambda: 'second') == ('first', 'HIT')
+  assert misses == [None]
+  stats = cache.stats()
+  assert (stats['hits'], stats['misses']) == (1, 0)
@@ -0,0 +1,208 @@
+import threading
+import time
+
+import pytest
+
+from llm_api.scheduler import PRIORITIES, Overloaded, Scheduler
+
+HIGH, NORMAL, LOW = PRIORITIES['high'], PRIORITIES['normal'], PRIORITIES['low']
+
+
+def wait_for(condition, timeout=2.0):
+  deadline = time.monotonic() + timeout
+  while not condition():
+    assert time.monotonic() < deadline, 'timed out'
+    time.sleep(0.001)
+
+
+class Waiter(threading.Thread):
+  """Calls acquire in the background and records how it ended."""
+
+  def __init__(self, scheduler, model, priority, timeout):
+    super().__init__(daemon=True)
+    self.scheduler = scheduler
+    self.model = model
+    self.priority = priority
+    self.timeout = timeout
+    self.ticket = None
+    self.error = None
+
+  def run(self):
+    try:
+      self.ticket = self.scheduler.acquire(self.model, self.priority,
+                                           self.timeout)
+    except Overloaded as e:
+      self.error = e
+
+
+def enqueue(scheduler, model, priority=NORMAL, timeout=5.0):
+  """Start a Waiter and return once its request has been queued."""
+  def settled():
+    stats = scheduler.stats()
+    return stats['queued'] + stats['rejected']
+  before = settled()
+  waiter = Waiter(scheduler, model, priority, timeout)
+  waiter.start()
+  wait_for(lambda: settled() > before or not waiter.is_alive())
+  assert waiter.is_alive(), 'expected the request to wait'
+  return waiter
+
+
+def test_grants_immediately_with_capacity():
+  scheduler = Scheduler(max_concurrency=2, model_concurrency=1)
+  a = scheduler.acquire('a')
+  b = scheduler.acquire('b')
+  assert a.granted and b.granted
+  assert scheduler.stats()['running_by_model'] == {'a': 1, 'b': 1}
+  scheduler.release(a)
+  scheduler.release(b)
+  assert scheduler.stats()['running'] == 0
+
+
+def test_release_admits_waiters_in_arrival_order():
+  scheduler = Scheduler(model_concurrency=1)
+  held = scheduler.acquire('a')
+  first = enqueue(scheduler, 'a')
+  second = enqueue(scheduler, 'a')
+
+  scheduler.release(held)
+  first.join(1)
+  assert first.ticket is not None
+  assert second.is_alive()
+
+  scheduler.release(first.ticket)
+  second.join(1)
+  assert second.ticket is not None
+  scheduler.release(second.ticket)
+
+
+def test_higher_priority_is_admitted_first():
+  scheduler = Scheduler(model_concurrency=1)
+  held = scheduler.acquire('a')
+  low = enqueue(scheduler, 'a', LOW)
+  high = enqueue(scheduler, 'a', HIGH)
+
+  scheduler.release(held)
+  high.join(1)
+  assert high.ticket is not None
+  assert low.is_alive()
+
+  scheduler.release(high.ticket)
+  low.join(1)
+  assert low.ticket is not None
+  scheduler.release(low.ticket)
+
+
+def test_full_queue_sheds_lowest_priority():
+  scheduler = Scheduler(model_concurrency=1, max_queue=2)
+  held = scheduler.acquire('a')
+  low = enqueue(scheduler, 'a', LOW)
+  normal = enqueue(scheduler, 'a', NORMAL)
+
+  high = enqueue(scheduler, 'a', HIGH)
+  low.join(1)
+  assert isinstance(low.error, Overloaded)
+  assert low.error.retry_after >= 1
+
+  # Nothing queued is less important than another low priority request
+  with pytest.raises(Overloaded):
+    scheduler.acquire('a', LOW)
+  assert scheduler.stats()['rejected'] == 2
+
+  scheduler.release(held)
+  high.join(1)
+  scheduler.release(high.ticket)
+  normal.join(1)
+  scheduler.release(normal.ticket)
+
+
+def test_queue_timeout_raises_overloaded():
+  scheduler = Scheduler(model_concurrency=1, queue_timeout=0.05)
+  held = scheduler.acquire('a')
+  with pytest.raises(Overloaded) as e:
+    scheduler.acquire('a')
+  assert e.value.retry_after >= 1
+  stats = scheduler.stats()
+  assert stats['timed_out'] == 1
+  assert stats['queued'] == 0
+  scheduler.release(held)
+
+
+def test_release_admits_other_models():
+  scheduler = Scheduler(max_concurrency=1)
+  held = scheduler.acquire('a')
+  waiter = enqueue(scheduler, 'b')
+  scheduler.release(held)
+  waiter.join(1)
+  assert waiter.ticket is not None and waiter.ticket.model == 'b'
+  scheduler.release(waiter.ticket)
+
+
+def test_backlogged_model_does_not_block_others():
+  scheduler = Scheduler(model_concurrency=2, max_queue=3)
+  held = [scheduler.acquire('a/a:v') for _ in range(2)]
+  waiters = [enqueue(scheduler, 'a/a:v') for _ in range(3)]
+
+  other = scheduler.acquire('c/c:v')
+  assert other.granted
+  scheduler.release(other)
+
+  for ticket in held:
+    scheduler.release(ticket)
+  for waiter in waiters:
+    wait_for(lambda: waiter.ticket is not None or waiter.error is not None)
+    if waiter.ticket is not None:
+      scheduler.release(waiter.ticket)
+  assert all(waiter.error is None for waiter in waiters)
+
+
+def test_queue_is_bounded_per_model():
+  scheduler = Scheduler(max_concurrency=2, model_concurrency=1, max_queue=4,
+                        model_max_queue=2)
+  a = scheduler.acquire('a')
+  b = scheduler.acquire('b')
+  waiters = [enqueue(scheduler, 'a') for _ in range(2)]
+  with pytest.raises(Overloaded):
+    scheduler.acquire('a')
+  waiters.append(enqueue(scheduler, 'b'))
+
+  scheduler.release(a)
+  scheduler.release(b)
+  for waiter in waiters:
+    wait_for(lambda: waiter.ticket is not None)
+    scheduler.release(waiter.ticket)
+  assert scheduler.stats()['running'] == 0
+
+
+def test_limits_are_split_between_workers():
+  scheduler = Scheduler(max_concurrency=64, model_concurrency=5,
+                        model_limits={'a': 6}, max_queue=128,
+                        model_max_queue=4, workers=4)
+  stats = scheduler.stats()
+  assert stats['max_concurrency'] == 16
+  assert stats['model_concurrency'] == 2
+  assert stats['max_queue'] == 32
+  assert stats['model_max_queue'] == 1
+  assert scheduler.model_limits == {'a': 2}
+
+
+@pytest.mark.parametrize('limits', [
+  {'model_limits': {'a': 2}},
+  {'model_concurrency': 7},
+  {'model_max_queue': 1},
+])
+def test_limits_below_the_worker_count_are_rejected(limits):
+  with pytest.raises(ValueError):
+    Scheduler(workers=8, **limits)
+
+
+def test_try_acquire_takes_only_free_slots():
+  scheduler = Scheduler(model_concurrency=1)
+  ticket = scheduler.try_acquire('a')
+  assert ticket.granted
+  assert scheduler.try_acquire('a') is None
+  stats = scheduler.stats()
+  assert (stats['queued'], stats['rejected']) == (0, 0)
+  scheduler.release(ticket)
+  scheduler.release(scheduler.try_acquire('a'))
+  assert scheduler.stats()['running'] == 0
@@ -0,0 +1,48 @@
+import random
+
+import pytest
+
+from llm_api import sentences
+
+
+def stream(text, cuts):
+  buffer = sentences.SentenceBuffer()
+  pieces = []
+  start = 0
+  for end in sorted(cuts) + [len(text)]:
+    pieces += buffer.feed(text[start:end])
+    start = end
+  pieces += buffer.finish()
+  return pieces
+
+
+@pytest.mark.parametrize('text, expected', [
+  ('Hello there. This is', 'Hello there.'),
+  ('Pi is 3.14 or so. Yes', 'Pi is 3.14 or so.'),
+  ('One!  Two?\nThree', 'One! Two?'),
+  ('no punctuation', ''),
+])
+def test_trim(text, expected):
+  assert sentences.trim(text) == expected
+
+
+@pytest.mark.parametrize('chunks', [
+  ['Pi is 3', '.', '14 or so.', ' Yes'],
+  ['Pi is 3.', '14 or so. Yes'],
+  ['Pi is 3.1', '4 or so. ', ' Yes'],
+])
+def test_decimal_point_split_across_chunks(chunks):
+  buffer = sentences.SentenceBuffer()
+  pieces = [p for chunk in chunks for p in buffer.feed(chunk)]
+  pieces += buffer.finish()
+  assert ''.join(pieces) == sentences.trim(''.join(chunks))
+  assert ''.join(pieces) == 'Pi is 3.14 or so.'
+
+
+def test_buffer_matches_trim_for_any_chunking():
+  rng = random.Random(0)
+  alphabet = ['a', 'b', ' ', '  ', '\n', '.', '!', '?', '3', '.14']
+  for _ in range(2000):
+    text = ''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 30)))
+    cuts = [rng.randint(0, len(text)) for _ in range(rng.randint(0, 6))]
+    assert ''.join(stream(text, cuts)) == sentences.trim(text), (text, cuts)
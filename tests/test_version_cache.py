@@ -0,0 +1,102 @@
+import threading
+import time
+
+import pytest
+from replicate.exceptions import ReplicateError
+
+from llm_api.version_cache import VersionCache
+
+STREAMING = {'components': {'schemas': {'Output': {
+  'type': 'array', 'x-cog-array-type': 'iterator'}}}}
+
+
+class FakeVersion:
+
+  def __init__(self, id):
+    self.id = id
+
+  def get_transformed_schema(self):
+    return STREAMING
+
+
+class FakeClient:
+  """Stands in for replicate.Client, counting version lookups."""
+
+  def __init__(self, delay=0.0, fail=False):
+    self.delay = delay
+    self.fail = fail
+    self.lookups = 0
+    self._lock = threading.Lock()
+    self.models = self
+
+  def get(self, model):
+    # client.models.get(model).versions.get(id)
+    return FakeModel(self)
+
+
+class FakeModel:
+
+  def __init__(self, client):
+    self.versions = self
+    self.client = client
+
+  def get(self, id):
+    client = self.client
+    with client._lock:
+      client.lookups += 1
+    time.sleep(client.delay)
+    if client.fail:
+      raise ReplicateError('lookup failed')
+    return FakeVersion(id)
+
+
+def test_concurrent_cold_gets_share_one_lookup():
+  client = FakeClient(delay=0.05)
+  cache = VersionCache(lambda: client)
+  results = []
+  threads = [threading.Thread(target=lambda: results.append(
+    cache.get('a/a:v1'))) for _ in range(10)]
+  for t in threads:
+    t.start()
+  for t in threads:
+    t.join(2)
+
+  assert client.lookups == 1
+  assert len(results) == 10
+  assert {version.id for version, _ in results} == {'v1'}
+  assert all(streams for _, streams in results)
+  assert cache.stats()['misses'] == 1
+
+
+def test_failed_lookup_is_not_cached():
+  client = FakeClient(fail=True)
+  cache = VersionCache(lambda: client)
+  with pytest.raises(ReplicateError):
+    cache.get('a/a:v1')
+  client.fail = False
+  version, _ = cache.get('a/a:v1')
+  assert version.id == 'v1'
+  assert client.lookups == 2
+  assert cache.get('a/a:v1')[0] is version
+  assert client.lookups == 2
+
+
+def test_entries_expire_and_evict():
+  client = FakeClient()
+  cache = VersionCache(lambda: client, ttl=0.05, maxsize=1)
+  cache.get('a/a:v1')
+  cache.get('a/a:v1')
+  assert client.lookups == 1
+  time.sleep(0.06)
+  cache.get('a/a:v1')
+  assert client.lookups == 2
+  cache.get('b/b:v1')
+  assert cache.stats()['size'] == 1
+  cache.get('a/a:v1')
+  assert client.lookups == 4
+
+
+def test_invalid_model_version():
+  cache = VersionCache(lambda: FakeClient())
+  with pytest.raises(ReplicateError):
+    cache.get('not-a-model')